@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+"""
+	Synthetic revision histories for the benchmarks.
+	A history is generated from a seed, one revision at a time, so a 100k revision history does not have to fit in memory:
+		- raw(): the WikiRevParser shape (user, content, links, urls, images, categories, sections), as read by newswork.py and covid19_data.py
+		- data_output(): the covid19_data.py output shape (words, wikipedian, edit_type, reverted)
+		- v2_output(): the covid19_v2.py output shape (wikipedian, words, new_ and deleted_ links and citations, sections and keyframes)
+"""
+
+import random
+import revision_analysis
+import utils
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+START = datetime(2020, 1, 1)
+VOCABULARY_SIZE = 20000
+
+class SyntheticHistory:
+	''' A deterministic revision history. Edits insert, delete and replace words and links, and some revert the previous revision.
+	Editors are drawn from a skewed distribution of registered users, IP addresses and bots, like on a busy page. '''
+
+	def __init__(self, revisions=1000, words=1000, links=200, urls=50, editors=500, seed=0):
+		self.revisions = revisions
+		self.words = words
+		self.links = links
+		self.urls = urls
+		self.editors = editors
+		self.seed = seed
+
+		rng = random.Random(seed)
+		self.vocabulary = ["w%s" % n for n in range(VOCABULARY_SIZE)]
+		self.link_pool = ["Link %s" % n for n in range(links * 10)]
+		# near-duplicates, e.g. "Ma'an" and "Maan", for the fuzzy matching
+		self.link_pool += [link.replace(" ", "") for link in rng.sample(self.link_pool, links)]
+		self.url_pool = ["https://www.example%s.com/news/%s" % (n % 97, n) for n in range(urls * 10)]
+		self.editor_names = [self._editor_name(n, rng) for n in range(editors)]
+		self.editor_weights = list(accumulate(1 / (n + 1) for n in range(editors)))
+		self.timestamps = [(START + timedelta(minutes=10*n)).strftime("%Y-%m-%dT%H:%M:%SZ") for n in range(revisions)]
+
+	def _editor_name(self, n, rng):
+		kind = rng.random()
+		if kind < 0.3: return "%s.%s.%s.%s" % tuple(rng.randrange(256) for _ in range(4))
+		if kind < 0.35: return "Editor%sBot" % n
+		return "Editor%s" % n
+
+	def __len__(self):
+		return self.revisions
+
+	def keys(self):
+		return list(self.timestamps)
+
+	def items(self):
+		return self.raw()
+
+	def _edit(self, rng, elements, pool, size, progress):
+		''' Insert, delete or replace a few elements at a random position.
+		Insertions are more likely while the list is below its target size, which grows to three times the initial size. '''
+
+		position = rng.randrange(len(elements) + 1)
+		changed = rng.randint(1, max(1, size // 100))
+		insert = 0.6 if len(elements) < size * (1 + 2 * progress) else 0.3
+		action = rng.random()
+		if action < insert:
+			elements[position:position] = rng.choices(pool, k=changed)
+		elif action < 0.8:
+			del elements[position:position + changed]
+		else:
+			elements[position:position+1] = rng.choices(pool, k=1)
+
+	def raw(self):
+		''' Yield (timestamp, revision) pairs in chronological order, in the WikiRevParser shape. '''
+
+		rng = random.Random(self.seed)
+		content = rng.choices(self.vocabulary, k=self.words)
+		links = rng.sample(self.link_pool, self.links)
+		urls = rng.sample(self.url_pool, self.urls)
+		sections = [["Section %s" % n] for n in range(5)]
+		previous = None
+
+		for n, timestamp in enumerate(self.timestamps):
+			progress = n / self.revisions
+			if previous != None and rng.random() < 0.05:
+				# revert to the previous revision
+				content, links, urls, sections = previous
+				previous = None
+			else:
+				previous = (list(content), list(links), list(urls), list(sections))
+				self._edit(rng, content, self.vocabulary, self.words, progress)
+				if rng.random() < 0.4: self._edit(rng, links, self.link_pool, self.links, progress)
+				if rng.random() < 0.2: self._edit(rng, urls, self.url_pool, self.urls, progress)
+				if rng.random() < min(0.02, 50 / self.revisions): sections = sections + [["Section %s" % len(sections)]]
+
+			yield timestamp, {
+				"user": rng.choices(self.editor_names, cum_weights=self.editor_weights)[0],
+				"content": " ".join(content),
+				"links": list(links),
+				"urls": list(urls),
+				"images": [],
+				"categories": [],
+				"sections": list(sections)
+			}
+
+	def data_output(self):
+		''' The history in the covid19_data.py output shape, with the words, edit types and reverts as covid19_data.py extracts them. '''
+
+		# covid19_data parses its arguments on import, e.g. run.py sets them before importing this module
+		import covid19_data
+
+		output = OrderedDict()
+		previous_values = {"words": 0, "images": 0, "links": 0, "urls": 0, "categories": 0}
+		word_counter = utils.WordCounter()
+		reverts = utils.RevertDetector()
+		for timestamp, revision in self.raw():
+			reverts.add(utils.state_fingerprint(revision, covid19_data.REVERT_FIELDS))
+			values = covid19_data.get_values(revision, word_counter)
+			edit_type = covid19_data.determine_edit_type(values, previous_values)
+			output[timestamp] = {"words": values["words"], "wikipedian": revision["user"], "edit_type": edit_type}
+			previous_values = values
+
+		for timestamp, is_reverted in zip(self.timestamps, reverts.mask()):
+			if is_reverted: output[timestamp]["reverted"] = True
+		return output
+
+	def v2_output(self, keyframe_interval=100):
+		''' The history in the covid19_v2.py output shape, with the deltas as multisets like covid19_v2.py stores them. '''
+
+		output = OrderedDict()
+		previous = {"links": [], "citations": []}
+		previous_sections = []
+		word_counter = utils.WordCounter()
+		for n, (timestamp, revision) in enumerate(self.raw()):
+			timestamp_output = {"wikipedian": revision["user"], "words": word_counter.count(revision["content"])}
+			for field, revision_field in [("links", "links"), ("citations", "urls")]:
+				new, deleted = revision_analysis.diff_lists(revision[revision_field], previous[field], fuzzy=False)
+				if new: timestamp_output["new_" + field] = new
+				if deleted: timestamp_output["deleted_" + field] = deleted
+				previous[field] = revision[revision_field]
+			if revision["sections"] != previous_sections: timestamp_output["sections"] = revision["sections"]
+			previous_sections = revision["sections"]
+			if n % keyframe_interval == 0:
+				timestamp_output.update({"links_keyframe": previous["links"], "citations_keyframe": previous["citations"], "sections_keyframe": previous_sections})
+
+			output[timestamp] = timestamp_output
+		return output
@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+"""
+	Benchmarks of the hot paths on synthetic revision histories (from generate.py), at several scales.
+	Each benchmark is timed, and then run once more under tracemalloc for its peak memory.
+	The preparation of a benchmark's input is not measured, except for the benchmarks that read the raw history
+	revision by revision: their time includes generating it, which is measured on its own as "generate raw".
+	Output: JSON with one result per benchmark and scale, e.g. data/benchmarks/20201018-120000.json
+
+	Run from the main repository, e.g.:
+		$ python3 code/benchmarks/run.py --scales 1000,10000,100000 --baseline data/benchmarks/20201018-120000.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+
+benchmark_directory = os.path.dirname(os.path.abspath(__file__))
+code_directory = os.path.dirname(benchmark_directory)
+sys.path[:0] = [benchmark_directory, code_directory, os.path.join(code_directory, "save_specific")]
+
+parser = argparse.ArgumentParser(description='''Benchmarks of the revision analysis hot paths on synthetic revision histories.''')
+parser.add_argument("--scales", default="1000,10000,100000", help="e.g. '1000,10000'. Numbers of revisions.")
+parser.add_argument("--words", default=1000, type=int, help="Words in the first revision.")
+parser.add_argument("--links", default=200, type=int, help="Links in the first revision.")
+parser.add_argument("--urls", default=50, type=int, help="Urls in the first revision.")
+parser.add_argument("--editors", default=500, type=int, help="Number of distinct editors.")
+parser.add_argument("--seed", default=0, type=int)
+parser.add_argument("--benchmarks", help="e.g. 'diff_lists,utils_io'. Only run the benchmarks whose name contains one of these.")
+parser.add_argument("--memory", default="y", help="e.g. 'n'. Skip the tracemalloc runs.")
+parser.add_argument("--output", default="data/benchmarks/%s.json" % datetime.now().strftime("%Y%m%d-%H%M%S"))
+parser.add_argument("--baseline", help="e.g. 'data/benchmarks/20201018-120000.json'. Earlier results to compare with.")
+
+args = parser.parse_args()
+
+# the analysis scripts parse their arguments on import
+sys.argv = [sys.argv[0], "benchmark"]
+import covid19_analyse
+import covid19_data
+import revision_analysis
+import utils
+import utils_io as uio
+import utils_news
+
+from collections import Counter
+from generate import SyntheticHistory
+from tabulate import tabulate
+
+EVENT = "benchmark"
+NEWS_SOURCES = os.path.join(os.path.dirname(code_directory), "resources", "news_sources", "")
+
+def links_per_revision(history):
+	return [revision["links"] for timestamp, revision in history.raw()]
+
+def run_generate(history):
+	for timestamp, revision in history.raw():
+		pass
+
+def run_diff_lists(link_lists):
+	prev = []
+	for curr in link_lists:
+		revision_analysis.diff_lists(curr, prev)
+		prev = curr
+
+def prepare_levenshtein(history):
+	''' The added and removed links of each revision, before the fuzzy matching. '''
+
+	pairs = []
+	prev = Counter()
+	for curr in links_per_revision(history):
+		curr = Counter(curr)
+		added, removed = revision_analysis.diff_counters(curr, prev)
+		if added and removed: pairs.append((list(added.elements()), list(removed.elements())))
+		prev = curr
+	return pairs
+
+def run_levenshtein(pairs):
+	for added, removed in pairs:
+		utils.allow_levenshtein_distance(list(added), list(removed))
+
+def run_list_development(history):
+	revision_analysis.Analyze(history, "xx", EVENT).list_development("links")
+
+def run_string_development(history):
+	revision_analysis.Analyze(history, "xx", EVENT).string_development("content")
+
+def run_get_values(history):
+	word_counter = utils.WordCounter()
+	for timestamp, revision in history.raw():
+		covid19_data.get_values(revision, word_counter)
+
+def run_process_data(data_output):
+	covid19_analyse.registry = utils.EditorRegistry()
+	covid19_analyse.process_data(data_output)
+
+def prepare_content_development(history):
+	covid19_analyse.registry = utils.EditorRegistry()
+	return covid19_analyse.process_data(history.data_output())
+
+def run_content_development(data):
+	covid19_analyse.get_content_development(data, data["timestamps"])
+
+def urls_per_revision(history):
+	return [(timestamp, revision["urls"]) for timestamp, revision in history.raw()]
+
+def run_news_shares(citations):
+	utils_news.NewsClassifier(NEWS_SOURCES).shares(citations, "da")
+
+def run_save_json(data_output):
+	uio.save_to_json(EVENT, "xx", data_output)
+
+def run_json_writer(data_output):
+	with uio.JSONWriter(EVENT, "xx") as writer:
+		for timestamp, record in data_output.items():
+			writer.write(timestamp, record)
+
+def prepare_stored(history):
+	uio.save_to_json(EVENT, "xx", history.data_output())
+	return "data/%s/xx.json" % EVENT
+
+def run_read_json(filename):
+	uio.read_from_json(filename)
+
+def run_revision_stream(filename):
+	for timestamp, revision in uio.RevisionStream(filename).items():
+		pass
+
+def run_save_columnar(data_output):
+	uio.save_columnar(EVENT, "xx", data_output)
+
+def prepare_columnar(history):
+	uio.save_columnar(EVENT, "xx", history.data_output())
+	return "xx"
+
+def run_read_columnar(language):
+	revisions = uio.read_columnar(EVENT, language)
+	revisions.column("words").sum()
+	revisions.column("wikipedian").max()
+
+def prepare_v2_stored(history):
+	uio.save_to_json(EVENT, "v2", history.v2_output())
+	return "data/%s/v2.json" % EVENT
+
+def prepare_list_field_reader(history):
+	return uio.ListFieldReader(history.v2_output())
+
+def run_list_field_reader(reader):
+	''' The citations and links at 1000 revisions spread over the history. '''
+
+	for n in range(0, len(reader), max(1, len(reader) // 1000)):
+		reader.state("citations", n)
+		reader.state("links", n)
+
+# name: (prepare the input, measured function)
+BENCHMARKS = {
+	"generate raw": (lambda history: history, run_generate),
+	"diff_lists": (links_per_revision, run_diff_lists),
+	"allow_levenshtein_distance": (prepare_levenshtein, run_levenshtein),
+	"Analyze.list_development": (lambda history: history, run_list_development),
+	"Analyze.string_development": (lambda history: history, run_string_development),
+	"covid19_data.get_values": (lambda history: history, run_get_values),
+	"covid19_analyse.process_data": (lambda history: history.data_output(), run_process_data),
+	"covid19_analyse.get_content_development": (prepare_content_development, run_content_development),
+	"utils_news.NewsClassifier.shares": (urls_per_revision, run_news_shares),
+	"utils_io.save_to_json": (lambda history: history.data_output(), run_save_json),
+	"utils_io.JSONWriter": (lambda history: history.data_output(), run_json_writer),
+	"utils_io.read_from_json": (prepare_stored, run_read_json),
+	"utils_io.read_from_json (covid19_v2)": (prepare_v2_stored, run_read_json),
+	"utils_io.ListFieldReader.state": (prepare_list_field_reader, run_list_field_reader),
+	"utils_io.RevisionStream": (prepare_stored, run_revision_stream),
+	"utils_io.save_columnar": (lambda history: history.data_output(), run_save_columnar),
+	"utils_io.read_columnar": (prepare_columnar, run_read_columnar)
+}
+
+def measure(function, state):
+	''' Get the wall time of one run, and the peak memory traced during a second run. '''
+
+	gc.collect()
+	start = time.perf_counter()
+	function(state)
+	seconds = time.perf_counter() - start
+
+	peak = None
+	if args.memory == "y":
+		gc.collect()
+		tracemalloc.start()
+		function(state)
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+	return seconds, peak
+
+def selected(name):
+	if not args.benchmarks: return True
+	return any(part in name for part in args.benchmarks.split(","))
+
+def run_benchmarks(scales):
+
+	results = []
+	for revisions in scales:
+		history = SyntheticHistory(revisions, args.words, args.links, args.urls, args.editors, args.seed)
+		for name, (prepare, function) in BENCHMARKS.items():
+			if not selected(name): continue
+
+			state = prepare(history)
+			seconds, peak = measure(function, state)
+			del state
+			results.append({"benchmark": name, "revisions": revisions, "seconds": round(seconds, 4), "peak_memory": peak})
+			print("%s\t%s revisions\t%.3f s" % (name, revisions, seconds))
+	return results
+
+def print_results(results, baseline):
+
+	earlier = {(r["benchmark"], r["revisions"]): r["seconds"] for r in baseline}
+	table = []
+	for r in results:
+		row = [r["benchmark"], r["revisions"], r["seconds"], None if r["peak_memory"] == None else round(r["peak_memory"] / 2**20, 1)]
+		if baseline:
+			previous = earlier.get((r["benchmark"], r["revisions"]))
+			row.append(round(r["seconds"] / previous, 2) if previous else None)
+		table.append(row)
+
+	headers = ["Benchmark", "Revisions", "Seconds", "Peak memory (MiB)"] + (["Ratio to baseline"] if baseline else [])
+	print(tabulate(table, headers=headers))
+
+def main():
+
+	output = os.path.abspath(args.output)
+	baseline = []
+	if args.baseline:
+		baseline = uio.read_from_json(args.baseline)["results"]
+
+	scales = [int(scale) for scale in args.scales.split(",")]
+
+	# the utils_io benchmarks write to data/benchmark/, in a temporary directory
+	working_directory = os.getcwd()
+	with tempfile.TemporaryDirectory() as directory:
+		os.chdir(directory)
+		os.mkdir("data")
+		try:
+			results = run_benchmarks(scales)
+		finally:
+			os.chdir(working_directory)
+
+	print_results(results, baseline)
+
+	os.makedirs(os.path.dirname(output), exist_ok=True)
+	with open(output, 'w') as outfile:
+		json.dump({
+			"created": datetime.now().isoformat(timespec="seconds"),
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"parameters": vars(args),
+			"results": results
+		}, outfile, indent=4)
+	print("Saved the results to", output)
+
+if __name__ == "__main__":
+	main()
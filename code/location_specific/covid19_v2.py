@@ -8,27 +8,40 @@
 		2) wikipedian
 		3) new links
 		4) deleted links
-		5) sections
+		5) sections, when they change
+		6) new citations
+		7) deleted citations
+	Every --keyframe_interval revisions, the full links, citations and sections are stored as well (links_keyframe etc.),
+	so the state at any revision can be rebuilt without replaying the whole history, see uio.ListFieldReader.
 """
 
 import argparse
 import os
 import re
 import revision_analysis
-import string
-import time
+import utils
+import utils_fetch
 import utils_io as uio
+import utils_profile as uprof
 import utils_visualization as uviz
 
-from collections import Counter, defaultdict, OrderedDict
-from WikiRevParser.wikirevparser import wikirevparser
+from collections import defaultdict, OrderedDict
 
 parser = argparse.ArgumentParser(description='''Extracts specific information per revision of a Wikipedia page. To overcome data storage issues, the revision histories are not saved, only the extracted information. Used for COVID19 analysis''')
 parser.add_argument("event", help="e.g. 'covid19'.")
 parser.add_argument("--language", help="e.g. 'nl' (for debugging).")
 parser.add_argument("--check_os", default="y")
+parser.add_argument("--update", default="n", help="e.g. 'y'. Append the revisions newer than the stored output instead of skipping or redoing a language.")
+parser.add_argument("--jobs", default=4, type=int, help="e.g. 4. Number of languages fetched at once.")
+parser.add_argument("--rate", default=1/3, type=float, help="e.g. 0.33. Fetches started per second across all languages.")
+parser.add_argument("--keyframe_interval", default=100, type=int, help="e.g. 100. Store the full links, citations and sections every this many revisions.")
+parser.add_argument("--profile", default="n", help="e.g. 'y', or 'memory' to also trace the peak memory. Time each stage per language, and save a report to data/profiles/.")
 
 args = parser.parse_args()
+profiler = uprof.Profiler(args.profile)
+
+# output field: field of the WikiRevParser revisions, stored as new_<field> and deleted_<field>
+DELTA_FIELDS = {"links": "links", "citations": "urls"}
 
 def get_language_titles():
 	""" Extract language and title from input file. """
@@ -49,19 +62,65 @@ def get_language_titles():
 
 	return language_titles
 
-def get_revisions(language, title):
-	""" Extract and parse Wikipedia revision history for given language and title. """
+def get_previous_state(output_dict):
+	""" Get the links, citations and sections after the last stored revision. """
+
+	reader = uio.ListFieldReader(output_dict)
+	last = len(reader) - 1
+	return {field: reader.state(field, last) for field in DELTA_FIELDS}, reader.state("sections", last)
+
+def extract(language, revisions, stored_output):
+	""" Fold the revisions into the per-revision output from old to new, and write each record right away.
+	One revision is processed at a time, and it is taken out of the parsed history when it is processed.
+	For an update, the stored output is written first and only the newer revisions are extracted.
+	The deltas of the links and citations are stored for every revision, and their full lists every --keyframe_interval revisions.
+	Returns the number of extracted revisions. """
+
+	previous, previous_sections = get_previous_state(stored_output)
+	last_timestamp = next(reversed(stored_output)) if len(stored_output) > 0 else None
+	extracted = 0
 
-	time.sleep(3)
-	parser_instance = wikirevparser.ProcessRevisions(language, title)
+	with uio.JSONWriter("%s/100720" % args.event, language) as writer:
+		for timestamp, timestamp_output in stored_output.items():
+			writer.write(timestamp, timestamp_output)
+
+		word_counter = utils.WordCounter()
+		n = len(stored_output)
+		for timestamp, revision in utils_fetch.iter_chronological(revisions):
+			if last_timestamp != None and timestamp <= last_timestamp: continue
+
+			timestamp_output = {}
+			timestamp_output["wikipedian"] = revision["user"]
+			timestamp_output["words"] = word_counter.count(revision["content"])
+			timestamp_output["sections"] = []
+		
+			# add new and deleted links and citations to memory
+			for field, revision_field in DELTA_FIELDS.items():
+				timestamp_output["new_" + field], timestamp_output["deleted_" + field] = revision_analysis.diff_lists(revision[revision_field], previous[field], fuzzy=False)
+				previous[field] = revision[revision_field]
 
-	page = parser_instance.wikipedia_page()
-	if page == None: return None
+			if revision["sections"]	!= previous_sections:
+				timestamp_output["sections"] = revision["sections"]
+				previous_sections = revision["sections"]
+
+			del_keys = []
+			for key in timestamp_output:
+				if timestamp_output[key] == []:
+					del_keys.append(key)
+			for key in del_keys:
+				del timestamp_output[key]
 
-	revisions = parser_instance.parse_revisions()
-	if revisions == None: return None
+			# keyframes are stored also when they are empty
+			if n % args.keyframe_interval == 0:
+				for field in DELTA_FIELDS:
+					timestamp_output[field + "_keyframe"] = previous[field]
+				timestamp_output["sections_keyframe"] = previous_sections
 
-	return revisions
+			writer.write(timestamp, timestamp_output)
+			extracted += 1
+			n += 1
+
+	return extracted
 
 def main():
 	""" 
@@ -71,67 +130,36 @@ def main():
 			2) wikipedian
 			3) new links
 			4) deleted links
-			5) sections
+			5) sections, when they change
+			6) new citations
+			7) deleted citations
+			8) the full links, citations and sections every --keyframe_interval revisions
 	"""
 
 	language_titles = get_language_titles()
+	to_fetch = OrderedDict()
 	for language in language_titles.keys():
 		title = language_titles[language]
 
-		if args.check_os == "y":
+		if args.check_os == "y" and args.update != "y":
 			if os.path.isfile("data/%s/100720/%s.json" % (args.event, language)):
 				print("%s has already been processed, moving on..." % language)
 				continue
+		to_fetch[language] = title
+
+	for language, revisions in utils_fetch.fetch_languages(to_fetch, jobs=args.jobs, rate=args.rate):
 		print("\nLanguage:\t", language)
-		print("Title:\t\t", title)
+		print("Title:\t\t", language_titles[language])
 
-		revisions = get_revisions(language, title)
 		if revisions is None: continue
-		timestamps = list(revisions.keys())
-		timestamps.reverse()
-
-		previous_links = []
-		previous_sections = []
-		output_dict = OrderedDict()
-
-		for n,timestamp in enumerate(timestamps):
-
-			timestamp_output = {}
-			timestamp_output["wikipedian"] = revisions[timestamp]["user"]
-			timestamp_output["words"] = len([w for w in revisions[timestamp]["content"].split() if w not in string.punctuation])
-			timestamp_output["sections"] = []
-			timestamp_output["new_links"] = []
-			timestamp_output["deleted_links"] = []
-			timestamp_output["citations"] = []
-			
-			# add new links to memory
-			for link in revisions[timestamp]["links"]:
-				if link not in previous_links:
-					timestamp_output["new_links"].append(link)
-
-			# add deleted links to memory
-			for link in previous_links:
-				if link not in revisions[timestamp]["links"]:
-					timestamp_output["deleted_links"].append(link)
-
-			previous_links = revisions[timestamp]["links"]
-
-			if revisions[timestamp]["sections"]	!= previous_sections:
-				timestamp_output["sections"] = revisions[timestamp]["sections"]
-				previous_sections = revisions[timestamp]["sections"]
-
-			del_keys = []
-			for key in timestamp_output:
-				if timestamp_output[key] == []:
-					del_keys.append(key)
-			for key in del_keys:
-				del timestamp_output[key]
 
-			timestamp_output["citations"] = revisions[timestamp]["urls"]
+		stored_output = uio.read_stored_output("%s/100720" % args.event, language) if args.update == "y" else OrderedDict()
 
-			output_dict[timestamp] = timestamp_output
+		with profiler.stage("extract", language) as record:
+			record["revisions"] = extract(language, revisions, stored_output)
+		if args.update == "y": print("New revisions:\t", record["revisions"])
 
-		uio.save_to_json("%s/100720/" % args.event, language, output_dict)
+	profiler.report("covid19_v2_%s" % args.event)
 
 if __name__ == "__main__":
 	main()
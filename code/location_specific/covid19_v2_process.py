@@ -9,21 +9,25 @@
 			3) new links
 			4) deleted links
 			5) sections
-	Output: Overview of the nationality of the references, whether they are local or global (local here == Danish).  
+			6) new and deleted citations, or the citations of each revision in older output
+	Output: Overview of the nationality of the references, whether they are local or global (local here == Danish),
+	and the shares of local news, foreign news and non-news citations per revision and over time (see utils_news.py).
 """
 
 import argparse
 import glob
+import json
 import matplotlib.pyplot as plt
 import os
-import pandas as pd
 import plotly.graph_objects as go
 import string
 import re
 import requests
 import revision_analysis
 import time
+import utils
 import utils_io as uio
+import utils_news
 import utils_visualization as uviz
 
 from collections import Counter, defaultdict, OrderedDict
@@ -34,29 +38,166 @@ parser = argparse.ArgumentParser(description='''Extracts specific information pe
 parser.add_argument("event", help="e.g. 'covid19'.")
 parser.add_argument("--language", help="e.g. 'nl' (for debugging).")
 parser.add_argument("--check_os", default="y")
+parser.add_argument("--sparql", default="https://query.wikidata.org/sparql", help="e.g. 'http://localhost:8000/sparql'. SPARQL endpoint for the location lookups.")
+parser.add_argument("--jobs", default=1, type=int, help="e.g. 4. Number of languages processed in parallel.")
 
 args = parser.parse_args()
 
+BATCH_SIZE = 100
 counter = 0
+cache = None
+news_classifier = utils_news.NewsClassifier()
 
-def check_if_location(entity, language):
+def get_cache():
+	""" Open the lookup cache once per process. """
+	global cache
+	if cache is None:
+		cache = uio.LookupCache("data/%s/wikidata_cache.sqlite" % args.event)
+	return cache
+
+def throttle():
 	global counter
 	if counter == 5:
 		time.sleep(5)
 		counter = 0
-	entity = entity.capitalize()
-	label='"'+entity+'"'
-	sparql = "https://query.wikidata.org/sparql"
-	rq_wiki="""  SELECT ?geo WHERE {{  ?country rdfs:label {0}@{1} .  ?country  wdt:P625 ?geo . }}"""
-	r = requests.get(sparql, params = {'format': 'json', 'query':rq_wiki.format(label, language)})
 	counter += 1
-	data = r.json()
-	if (pd.json_normalize(data['results']['bindings']).empty is False):
-		results_df = pd.json_normalize(data['results']['bindings']).iloc[0][2]
-		return results_df
+
+def query_location(label, language):
+	throttle()
+	rq_wiki="""  SELECT ?geo WHERE {{  ?country rdfs:label {0}@{1} .  ?country  wdt:P625 ?geo . }}"""
+	r = requests.get(args.sparql, params = {'format': 'json', 'query':rq_wiki.format('"'+label+'"', language)})
+	bindings = r.json()['results']['bindings']
+	if len(bindings) > 0:
+		return bindings[0]['geo']['value']
 	else:
 		pass #print("the entity is not a location on Wikidata")
 
+def query_locations(keys):
+	""" Query the coordinates of many (label, language) pairs in one request with a VALUES clause. Labels without coordinates get None. """
+	throttle()
+	values = " ".join("%s@%s" % (json.dumps(label, ensure_ascii=False), language) for (label, language) in keys)
+	rq_wiki="""  SELECT ?label ?geo WHERE {{ VALUES ?label {{ {0} }} ?country rdfs:label ?label .  ?country  wdt:P625 ?geo . }}"""
+	r = requests.post(args.sparql, data = {'format': 'json', 'query':rq_wiki.format(values)})
+	r.raise_for_status()
+
+	locations = {key: None for key in keys}
+	for binding in r.json()['results']['bindings']:
+		key = (binding['label']['value'], binding['label'].get('xml:lang'))
+		if locations.get(key, 0) is None:
+			locations[key] = binding['geo']['value']
+	return locations
+
+def resolve_locations(entities, language):
+	""" Fill the lookup cache for all the labels check_if_location can ask for, in batches of BATCH_SIZE labels.
+	Labels of a batch that fails are queried one by one. """
+
+	keys = set()
+	for entity in entities:
+		if len(entity.strip()) == 0 or entity[0] == "_": continue
+		keys.add((entity.capitalize(), language))
+		keys.add((entity.capitalize(), "en"))
+		keys.add((entity.split()[0].capitalize(), language))
+		keys.add((entity.split("-")[0].capitalize(), language))
+	keys = sorted(key for key in keys if get_cache().get(list(key)) is uio.LookupCache.MISSING)
+	print("Resolving %s labels in %s batches" % (len(keys), -(-len(keys) // BATCH_SIZE)))
+
+	for n in range(0, len(keys), BATCH_SIZE):
+		batch = keys[n:n+BATCH_SIZE]
+		try:
+			locations = query_locations(batch)
+		except (requests.RequestException, ValueError, KeyError) as err:
+			print("Batch query failed, querying the labels one by one:\t", err)
+			locations = {key: query_location(*key) for key in batch}
+
+		for key, location in locations.items():
+			get_cache().set(list(key), location)
+	get_cache().commit()
+
+def check_if_location(entity, language):
+	""" Get the coordinates of an entity from Wikidata, or None if it is not a location. 
+	Answers, also None, are cached on disk, so an entity is only queried once per language. """
+	entity = entity.capitalize()
+	location = get_cache().get([entity, language])
+	if location is not uio.LookupCache.MISSING:
+		return location
+
+	location = query_location(entity, language)
+	get_cache().set([entity, language], location)
+	return location
+
+def process_language(filename):
+	""" Find the locations among the new links of one language over time. Returns None for skipped languages. """
+
+	language = filename.split("/")[-1].split(".")[0]
+	if args.language:
+		if language != args.language: return None
+
+	print("\nLanguage:\t", language)
+
+	if args.check_os == "y":
+		if os.path.isfile(f"visualizations/{args.event}/content_magnitude/{language}.png"):
+			print(f"{language} has already been analyzed, moving on...")
+			return None
+
+	input_data = uio.read_from_json(filename)
+	timestamps = list(input_data.keys())
+	resolve_locations(set(entity for timestamp in timestamps for entity in input_data[timestamp].get("new_links", [])), language)
+
+	danish = []
+	locations = []
+	number_of_danish = []
+	number_of_locations = []
+
+	for timestamp in timestamps:
+		try:
+			entities = input_data[timestamp]["new_links"]
+			for entity in entities:
+				if entity[0] == "_":
+					danish.append(entity)
+					locations.append(entity)
+					print("**", entity)
+				elif check_if_location(entity, language) != None:
+					locations.append(entity)
+					print("*", entity)
+				elif check_if_location(entity, "en") != None:
+					locations.append(entity)
+					print("*", entity)
+				elif check_if_location(entity.split()[0], language) != None:
+					locations.append(entity)
+					print("*", entity)
+				elif check_if_location(entity.split("-")[0], language) != None:
+					locations.append(entity)
+					print("*", entity)
+				
+		except KeyError:
+			pass
+		try:
+			entities = input_data[timestamp]["deleted_links"]
+			for entity in entities:
+				if entity in locations:
+					locations.remove(entity)
+		except KeyError:
+				pass
+		
+		number_of_danish.append(len(danish))
+		number_of_locations.append(len(locations))
+
+	get_cache().commit()
+
+	citations = uio.ListFieldReader(input_data).states("citations")
+	news = news_classifier.shares(zip(timestamps, citations), language)
+	return {
+		"language": language,
+		"danish": danish,
+		"locations": locations,
+		"number_of_danish": number_of_danish,
+		"number_of_locations": number_of_locations,
+		"timestamps": timestamps,
+		"news_counts": news["counts"].tolist(),
+		"news_shares": news["shares"].tolist(),
+		"cumulative_news_shares": news["cumulative_shares"].tolist()
+	}
+
 def main():
 	""" 
 		Get revision histories and use the size changes of the different elements to determine edit type.
@@ -69,65 +210,23 @@ def main():
 	"""
 
 	directory = "data/%s/020720/*.json" % args.event
-	for filename in sorted(glob.glob(directory)):
-
-		language = filename.split("/")[-1].split(".")[0]
-		if args.language:
-			if language != args.language: continue
-
-		print("\nLanguage:\t", language)
-
-		if args.check_os == "y":
-			if os.path.isfile(f"visualizations/{args.event}/content_magnitude/{language}.png"):
-				print(f"{language} has already been analyzed, moving on...")
-				continue
-
-		input_data = uio.read_from_json(filename)
-		timestamps = list(input_data.keys())
-		danish = []
-		locations = []
-		number_of_danish = []
-		number_of_locations = []
-
-		for timestamp in timestamps:
-			try:
-				entities = input_data[timestamp]["new_links"]
-				for entity in entities:
-					if entity[0] == "_":
-						danish.append(entity)
-						locations.append(entity)
-						print("**", entity)
-					elif check_if_location(entity, language) != None:
-						locations.append(entity)
-						print("*", entity)
-					elif check_if_location(entity, "en") != None:
-						locations.append(entity)
-						print("*", entity)
-					elif check_if_location(entity.split()[0], language) != None:
-						locations.append(entity)
-						print("*", entity)
-					elif check_if_location(entity.split("-")[0], language) != None:
-						locations.append(entity)
-						print("*", entity)
-					
-			except KeyError:
-				pass
-			try:
-				entities = input_data[timestamp]["deleted_links"]
-				for entity in entities:
-					if entity in locations:
-						locations.remove(entity)
-			except KeyError:
-					pass
-			
-			number_of_danish.append(len(danish))
-			number_of_locations.append(len(locations))
-		
-		print(danish)
-		print(locations)
-		print(number_of_danish)
-		print(number_of_locations)
-		print(timestamps)
+	news_table = []
+	for result in utils.map_languages(process_language, sorted(glob.glob(directory)), args.jobs):
+		if result == None: continue
+		if len(result["timestamps"]) > 0:
+			local, foreign, non_news = result["news_counts"][-1]
+			cumulative_local, cumulative_foreign, _ = result["cumulative_news_shares"][-1]
+			news_table.append([result["language"], local, foreign, non_news, round(cumulative_local*100, 1), round(cumulative_foreign*100, 1)])
+
+		print("\nLanguage:\t", result["language"])
+		print(result["danish"])
+		print(result["locations"])
+		print(result["number_of_danish"])
+		print(result["number_of_locations"])
+		print(result["timestamps"])
+
+	print("\n********** News citations (last revision, and % of all urls cited over time) **********")
+	print(tabulate(news_table, headers=["Language", "Local", "Foreign", "Non-news", "Local (%)", "Foreign (%)"]))
 
 if __name__ == "__main__":
 	main()
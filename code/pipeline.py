@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+"""
+	Runs a workflow as a graph of stages, with one task per language and stage, and only recomputes the stale artifacts.
+	Each task runs one of the scripts, and is keyed by a hash of the script and the modules it imports, its arguments,
+	its line in the event file and the contents of the artifacts it reads. A task is stale if its key is not the one
+	in the manifest (data/<event>/pipeline/<workflow>.json) or if one of its outputs is missing.
+	Tasks run in parallel as soon as the tasks they depend on are done.
+
+	The revisions are fetched by the extract scripts, so a fetch is redone only when an extract task is stale,
+	or when it is forced, e.g. --force extract.
+
+	Run from the main repository, e.g.:
+		$ python3 code/pipeline.py covid19 --workflow covid19 --jobs 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import utils_fetch
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description='''Runs the stages of a workflow and only recomputes the stale artifacts.''')
+parser.add_argument("event", help="e.g. 'covid19'.")
+parser.add_argument("--workflow", default="covid19", help="e.g. 'covid19', 'location' or 'newswork'.")
+parser.add_argument("--language", help="e.g. 'nl' (for debugging).")
+parser.add_argument("--jobs", default=4, type=int, help="e.g. 4. Number of tasks run at once.")
+parser.add_argument("--rate", default=1/3, type=float, help="e.g. 0.33. Fetches started per second, shared by the extract tasks.")
+parser.add_argument("--force", default="", help="e.g. 'extract,analyse' or 'all'. Recompute these stages even if their artifacts are up to date.")
+parser.add_argument("--dry_run", default="n", help="e.g. 'y'. Only print which tasks are stale.")
+
+args = parser.parse_args()
+
+CODE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# each extract task fetches one language, so the extract tasks are started at --rate, rather than each limiting itself
+fetch_bucket = utils_fetch.TokenBucket(args.rate)
+
+# stage: script, arguments, the file with the language titles (extract) or the stages it depends on,
+# the artifacts it writes, and whether it runs once per language.
+WORKFLOWS = {
+	"covid19": [
+		{"stage": "extract", "script": "save_specific/covid19_data.py", "arguments": ["--check_os", "n"], "titles": "resources/events/{event}.tsv",
+			"outputs": ["data/{event}/{language}.json"], "fetch": True},
+		{"stage": "analyse", "script": "save_specific/covid19_analyse.py", "arguments": ["--check_os", "n", "--save_results", "y"], "depends": ["extract"],
+			"outputs": ["data/{event}/results/{language}.json"]},
+		{"stage": "report", "script": "save_specific/covid19_analyse.py", "arguments": ["--from_results", "y"], "depends": ["analyse"],
+			"outputs": ["visualizations/creation_times.html"], "per_language": False},
+		{"stage": "ingest", "script": "utils_db.py", "arguments": [], "depends": ["extract"],
+			"outputs": ["data/{event}/revisions.sqlite"], "per_language": False}
+	],
+	"location": [
+		{"stage": "extract", "script": "location_specific/covid19_v2.py", "arguments": ["--check_os", "n"], "titles": "resources/events/{event}.tsv",
+			"outputs": ["data/{event}/100720/{language}.json"], "fetch": True},
+		# covid19_v2_process reads the snapshot in 020720/, not the output of extract
+		{"stage": "process", "script": "location_specific/covid19_v2_process.py", "arguments": ["--check_os", "n"], "titles": "resources/events/{event}.tsv",
+			"inputs": ["data/{event}/020720/{language}.json"], "outputs": []}
+	],
+	"newswork": [
+		{"stage": "extract", "script": "save_output/get_revisions.py", "arguments": ["--check_os", "n"], "titles": "resources/events/{event}.txt",
+			"outputs": ["data/{event}/{language}.json"], "fetch": True},
+		# newswork.py analyses every language in one run
+		{"stage": "analyse", "script": "save_output/newswork.py", "arguments": [], "depends": ["extract"], "outputs": [], "per_language": False}
+	]
+}
+
+def get_languages(workflow):
+	''' The languages of the event file, like get_language_titles in the extract scripts. '''
+
+	titles = [stage["titles"] for stage in workflow if "titles" in stage][0].format(event=args.event)
+	languages = []
+	for line in sorted(open(titles).readlines()):
+		language = re.split("[\t,]", line)[0].strip()
+		if language in ["", "lang"] or language.startswith("%"): continue
+		if args.language and language != args.language: continue
+		languages.append(language)
+	return languages
+
+def title_line(stage, language):
+	if "titles" not in stage: return None
+	for line in open(stage["titles"].format(event=args.event)):
+		if re.split("[\t,]", line)[0].strip() == language: return line.strip()
+	return None
+
+def imported_modules(filename, seen):
+	''' The file and the modules of this repository it imports, recursively. '''
+
+	seen.add(filename)
+	modules = []
+	for line in open(filename):
+		if line.startswith("import "): modules += [name.split()[0] for name in line[len("import "):].split(",")]
+		elif line.startswith("from "): modules.append(line.split()[1])
+
+	for module in modules:
+		for directory in [os.path.dirname(filename), CODE_DIRECTORY]:
+			path = os.path.join(directory, module + ".py")
+			if os.path.isfile(path) and path not in seen:
+				imported_modules(path, seen)
+				break
+	return seen
+
+def code_hash(script):
+	digest = hashlib.sha256()
+	for filename in sorted(imported_modules(os.path.join(CODE_DIRECTORY, script), set())):
+		with open(filename, "rb") as infile:
+			digest.update(infile.read())
+	return digest.hexdigest()
+
+def file_hash(filename, manifest):
+	''' Hash the contents of a file, reusing the hash in the manifest while the size and modification time are the same. '''
+
+	if not os.path.isfile(filename): return None
+	status = os.stat(filename)
+	stored = manifest["files"].get(filename)
+	if stored and stored[:2] == [status.st_size, status.st_mtime_ns]: return stored[2]
+
+	digest = hashlib.sha256()
+	with open(filename, "rb") as infile:
+		for chunk in iter(lambda: infile.read(1 << 20), b""):
+			digest.update(chunk)
+	manifest["files"][filename] = [status.st_size, status.st_mtime_ns, digest.hexdigest()]
+	return digest.hexdigest()
+
+class Task:
+
+	def __init__(self, stage, language):
+		self.stage = stage
+		self.language = language
+		self.name = stage["stage"] if language == None else "%s/%s" % (stage["stage"], language)
+		self.depends = []
+		self.key = None
+
+	def paths(self, field):
+		return [path.format(event=args.event, language=self.language) for path in self.stage.get(field, [])]
+
+	def inputs(self):
+		return self.paths("inputs") + [path for task in self.depends for path in task.paths("outputs")]
+
+	def command(self):
+		command = [sys.executable, os.path.join(CODE_DIRECTORY, self.stage["script"]), args.event] + self.stage["arguments"]
+		if self.language != None:
+			command += ["--language", self.language]
+		if self.stage.get("fetch"):
+			# the task is started within the rate limit, its own share only paces the retries
+			command += ["--jobs", "1", "--rate", str(args.rate / args.jobs)]
+		return command
+
+	def compute_key(self, code_hashes, manifest):
+		script = self.stage["script"]
+		if script not in code_hashes: code_hashes[script] = code_hash(script)
+
+		key = {
+			"stage": self.stage["stage"],
+			"code": code_hashes[script],
+			"arguments": self.stage["arguments"],
+			"language": self.language,
+			"title": title_line(self.stage, self.language) if self.language != None else None,
+			"inputs": [[path, file_hash(path, manifest)] for path in self.inputs()]
+		}
+		self.key = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+		return self.key
+
+	def is_stale(self, manifest, forced):
+		if forced: return True
+		stored = manifest["tasks"].get(self.name)
+		if stored == None or stored["key"] != self.key: return True
+		return not all(os.path.isfile(path) for path in self.paths("outputs"))
+
+def build_tasks(workflow, languages):
+	''' One task per stage and language, or per stage for the stages that merge all languages. '''
+
+	tasks = {}
+	for stage in workflow:
+		per_language = stage.get("per_language", True)
+		for language in (languages if per_language else [None]):
+			task = Task(stage, language)
+			for upstream in stage.get("depends", []):
+				if per_language: task.depends.append(tasks["%s/%s" % (upstream, language)])
+				else: task.depends += [tasks["%s/%s" % (upstream, l)] for l in languages]
+			tasks[task.name] = task
+	return list(tasks.values())
+
+def run_task(task, log_directory):
+
+	log_name = log_directory + "%s.log" % task.name.replace("/", "_")
+	environment = dict(os.environ)
+	directories = [CODE_DIRECTORY, os.path.join(CODE_DIRECTORY, os.path.dirname(task.stage["script"]))]
+	environment["PYTHONPATH"] = os.pathsep.join(directories + [environment.get("PYTHONPATH", "")])
+
+	if task.stage.get("fetch"):
+		fetch_bucket.acquire()
+	with open(log_name, 'w') as log:
+		completed = subprocess.run(task.command(), stdout=log, stderr=subprocess.STDOUT, env=environment)
+	return completed.returncode
+
+def read_manifest(filename):
+	if not os.path.isfile(filename): return {"tasks": {}, "files": {}}
+	with open(filename) as infile:
+		return json.load(infile)
+
+def save_manifest(filename, manifest):
+	with open(filename + ".tmp", 'w') as outfile:
+		json.dump(manifest, outfile, indent=4, sort_keys=True)
+	os.replace(filename + ".tmp", filename)
+
+def main():
+
+	workflow = WORKFLOWS[args.workflow]
+	forced = set(stage["stage"] for stage in workflow) if args.force == "all" else set(args.force.split(","))
+
+	directory_name = "data/%s/pipeline/" % args.event
+	log_directory = directory_name + "logs/"
+	os.makedirs(log_directory, exist_ok=True)
+	manifest_name = directory_name + "%s.json" % args.workflow
+	manifest = read_manifest(manifest_name)
+
+	tasks = build_tasks(workflow, get_languages(workflow))
+	code_hashes = {}
+	done, failed, skipped = set(), set(), set()
+	running = {}
+
+	with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+		while len(done) + len(failed) + len(skipped) < len(tasks):
+			for task in tasks:
+				if task.name in done or task.name in failed or task.name in skipped or task in running.values(): continue
+				if any(upstream.name in failed or upstream.name in skipped for upstream in task.depends):
+					if args.dry_run == "y" and not any(upstream.name in failed for upstream in task.depends):
+						print("Stale:\t", task.name, "(after a stale task)")
+					skipped.add(task.name)
+					continue
+				if not all(upstream.name in done for upstream in task.depends): continue
+
+				task.compute_key(code_hashes, manifest)
+				if not task.is_stale(manifest, task.stage["stage"] in forced):
+					done.add(task.name)
+				elif args.dry_run == "y":
+					print("Stale:\t", task.name)
+					# the tasks after a stale task are stale too
+					skipped.add(task.name)
+				else:
+					print("Running:\t", task.name)
+					running[executor.submit(run_task, task, log_directory)] = task
+
+			if len(running) == 0: continue
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in finished:
+				task = running.pop(future)
+				if future.result() != 0:
+					print("Failed:\t\t %s, see %s" % (task.name, log_directory))
+					failed.add(task.name)
+					continue
+
+				done.add(task.name)
+				manifest["tasks"][task.name] = {"key": task.key, "finished": datetime.now().isoformat(timespec="seconds")}
+				for path in task.paths("outputs"):
+					file_hash(path, manifest)
+				save_manifest(manifest_name, manifest)
+
+	save_manifest(manifest_name, manifest)
+	print("%s tasks up to date or done, %s failed, %s skipped." % (len(done), len(failed), len(skipped)))
+
+if __name__ == "__main__":
+	main()
@@ -10,45 +10,47 @@
 
 import argparse
 import nltk
+import numpy as np
 import re
 import string
 import utils
 import utils_io as uio
+import utils_time
 import utils_visualization as uviz
 
 from collections import defaultdict, Counter
-from datetime import datetime, date
+from datetime import date
 
 def diff_counters(curr, prev):
+	''' Get the multiset difference between two Counters. Returns a Counter of added and a Counter of removed elements. '''
 
-	added = 0
-	removed = 0
-	for ck, cv in curr.items():
-		if ck in prev.keys():
+	return curr - prev, prev - curr
 
-			if cv == prev[ck]: continue
+def _expand(elements, counts):
+	''' Pick the elements with a positive count from a list, in list order. '''
 
-			diff = cv - prev[ck]
+	counts = counts.copy()
+	expanded = []
+	for x in elements:
+		if counts[x] > 0:
+			counts[x] -= 1
+			expanded.append(x)
+	return expanded
 
-			if diff > 0: added += diff
-			elif diff < 0: removed += diff
-
-		else:
-			added += cv
-
-	for pk, pv in prev.items():
-		if pk not in curr.keys(): removed -= pv
-
-	return added, removed
-
-def diff_lists(curr, prev):
-	''' Get the difference between two lists in data. Returns two lists, one with additions over time, and one with removals over time.'''
+def diff_lists(curr, prev, fuzzy=True, curr_counts=None, prev_counts=None):
+	''' Get the difference between two lists in data. Returns two lists, one with additions over time, and one with removals over time.
+	Duplicates are treated as a multiset, so the cost is linear in the length of the lists. 
+	Counters of the lists can be passed in when the caller already keeps them. '''
 	if curr == prev: return [], []
 
-	added = [x for x in curr if x not in prev]
-	removed = [x for x in prev if x not in curr] 
+	if curr_counts is None: curr_counts = Counter(curr)
+	if prev_counts is None: prev_counts = Counter(prev)
+	added_counts, removed_counts = diff_counters(curr_counts, prev_counts)
+	added = _expand(curr, added_counts)
+	removed = _expand(prev, removed_counts)
 
 	# allow slight differences, e.g. "Ma'an" == "Maan"
+	if not fuzzy: return added, removed
 	if len(added) == 0 or len(removed) == 0: return added, removed
 	added, removed = utils.allow_levenshtein_distance(added, removed)
 	
@@ -59,30 +61,62 @@ def diff_lists(curr, prev):
 		
 class Analyze:
 
-	def __init__(self, data, language, topic, daily=True):
+	def __init__(self, data, language, topic, daily=True, renderer=None):
 		self.data = data
+		self.renderer = renderer
 		self.language = language
 		self.topic = topic
 		self.timestamps = sorted(list(self.data.keys()))
 		self.dates = self.timestamps
-
-	def _remove_vandalism(self, added_elements, removed_elements):
-
-		timepoints = list(removed_elements.keys())
-		for n in range(len(timepoints)-1):
-			if removed_elements[timepoints[n]] == added_elements[timepoints[n+1]] and len(removed_elements[timepoints[n]]) != 0:
-				removed_elements[timepoints[n]] = []
-				added_elements[timepoints[n+1]] = []
-		return added_elements, removed_elements
-
-	def get_users(self):
-		users = Counter()
-		for t in self.timestamps:
-			users[self.data[t]["user"]] += 1
-		return users
-
-	def list_development(self, element_type, remove_vandalism=False, visualize=False):
-		''' Analyze and plot the development of links or urls over time. '''
+		self.index = utils_time.TimestampIndex(self.timestamps)
+
+	def _remove_reverts(self, mask, added_counts, removed_counts, added_elements=None, removed_elements=None):
+		''' Leave out the changes of the revisions in reverted spans (see utils.RevertDetector), e.g. vandalism and its revert.
+		The total counts stay as they are, since they are the state of each revision. '''
+
+		for n in np.flatnonzero(mask):
+			added_counts[n] = 0
+			removed_counts[n] = 0
+			timestamp = self.timestamps[n]
+			if added_elements is not None and timestamp in added_elements:
+				added_elements[timestamp] = []
+				removed_elements[timestamp] = []
+
+	def _revisions(self):
+		''' Iterate over (timestamp, revision) pairs in chronological order, also when the data is a uio.RevisionStream. '''
+
+		if isinstance(self.data, dict):
+			for timestamp in self.timestamps:
+				yield timestamp, self.data[timestamp]
+		else:
+			yield from self.data.items()
+
+	def get_users(self, registry=None):
+		''' Get the number of edits per editor as an integer array, one entry per editor of this language. '''
+
+		if registry is None: registry = utils.EditorRegistry()
+		ids, _ = registry.encode(revision["user"] for _, revision in self._revisions())
+		edits = np.bincount(ids)
+		return edits[edits > 0]
+
+	def _read_checkpoint(self, element_type):
+		''' Get the stored state of an earlier analysis, if it was made on a prefix of the current revision history. '''
+
+		state = uio.read_checkpoint(self.topic, self.language, element_type)
+		if state is None: return None
+
+		processed = state["processed"]
+		if processed == 0 or processed > len(self.timestamps): return None
+		if self.timestamps[processed-1] != state["last_timestamp"]: return None
+		# checkpoints from before the revert detection
+		if "fingerprints" not in state: return None
+		return state
+
+	def list_development(self, element_type, remove_vandalism=False, visualize=False, checkpoint=False):
+		''' Analyze and plot the development of links or urls over time. 
+		The normalized elements of each revision are kept as the previous state of the next revision, so every revision is lowercased once.
+		With checkpoint=True, the state is saved after the last revision and a later analysis only processes the new revisions.
+		With remove_vandalism=True, the changes of reverted revisions and of their reverts are left out, at any distance. '''
 		# Veel van de diffs in lists zijn kleine verschillen in spelling of specificatie, e.g. "anna", "anna (phd)"
 		
 		# elements are for actual links, urls etc
@@ -93,54 +127,96 @@ class Analyze:
 		added_counts = []
 		removed_counts = []
 		total_counts = []
-			
-		for n in range(len(self.timestamps)):
-			curr_total = len(self.data[self.timestamps[n]][element_type])
-			total_counts.append(curr_total)
 
-			if curr_total == 0:
+		# running state of the previous revision
+		prev = []
+		prev_counts = Counter()
+		start = 0
+		reverts = utils.RevertDetector()
+
+		state = self._read_checkpoint(element_type) if checkpoint else None
+		if state is not None:
+			removed_elements = state["removed_elements"]
+			added_elements = state["added_elements"]
+			added_counts = state["added_counts"]
+			removed_counts = state["removed_counts"]
+			total_counts = state["total_counts"]
+			prev = state["previous"]
+			prev_counts = Counter(prev)
+			start = state["processed"]
+			reverts = utils.RevertDetector(state["fingerprints"])
+			
+		for n, (timestamp, revision) in enumerate(self._revisions()):
+			if n < start: continue
+			curr = [x.lower() for x in revision[element_type]]
+			curr_counts = Counter(curr)
+			total_counts.append(len(curr))
+			reverts.add(utils.state_fingerprint({element_type: curr}, [element_type]))
+
+			if len(curr) == 0:
 				added_counts.append(0)
 				removed_counts.append(0)
-				continue
 
-			if n == 0: 
-				added_elements[self.timestamps[n]] = [x.lower() for x in self.data[self.timestamps[n]][element_type]]
-				removed_elements[self.timestamps[n]] = []
+			elif n == 0: 
+				added_elements[timestamp] = curr
+				removed_elements[timestamp] = []
 
 				added_counts.append(1)
 				removed_counts.append(0)
 			else:
-				curr = [x.lower() for x in self.data[self.timestamps[n]][element_type]]
-				prev = [x.lower() for x in self.data[self.timestamps[n-1]][element_type]]
-
-				added, removed = diff_lists(curr, prev)
-				added_elements[self.timestamps[n]] = added
-				removed_elements[self.timestamps[n]] = removed
+				added, removed = diff_lists(curr, prev, curr_counts=curr_counts, prev_counts=prev_counts)
+				added_elements[timestamp] = added
+				removed_elements[timestamp] = removed
 
 				if len(added) == 0: added_counts.append(0)
 				else: added_counts.append(len(added))
 				if len(removed) == 0: removed_counts.append(0)
 				else: removed_counts.append(-len(removed))
 
+			prev, prev_counts = curr, curr_counts
+
+		if checkpoint and len(self.timestamps) > 0:
+			uio.save_checkpoint(self.topic, self.language, element_type, {
+				"processed": len(self.timestamps),
+				"last_timestamp": self.timestamps[-1],
+				"previous": prev,
+				"fingerprints": reverts.fingerprints,
+				"added_elements": added_elements,
+				"removed_elements": removed_elements,
+				"added_counts": added_counts,
+				"removed_counts": removed_counts,
+				"total_counts": total_counts
+			})
+
 		if remove_vandalism:
-			added_elements, removed_elements = self._remove_vandalism(added_elements, removed_elements)
+			self._remove_reverts(reverts.mask(), added_counts, removed_counts, added_elements, removed_elements)
 
 		if visualize:
-			y = [datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ") for ts in self.timestamps]
-			uviz.plot_changes(y, added_counts, removed_counts, total_counts, self.topic, self.language, element_type)
+			y = self.index.datetimes()
+			uviz.plot_changes(y, added_counts, removed_counts, total_counts, self.topic, self.language, element_type, renderer=self.renderer)
 
 		return added_counts, removed_counts, total_counts
 
-	def string_development(self, element_type, visualize=False):
+	def string_development(self, element_type, remove_vandalism=False, visualize=False, spans=False):
+		''' Analyze and plot the words added and removed per revision, with a token diff of the region that changed.
+		With spans=True, also returns the added and removed token ranges per timestamp.
+		With remove_vandalism=True, the changes of reverted revisions and of their reverts are left out. '''
 
-		# todo: remove vandalism. If x_t == x_t+2, remove x_t and x_t1
 		added = []
 		removed = []
 		totals = []
-
-		for n in range(len(self.timestamps)):
-			curr_total = len(self.data[self.timestamps[n]][element_type].split())
+		changed_spans = dict()
+
+		prev_text = ""
+		prev_total = 0
+		reverts = utils.RevertDetector()
+		for n, (timestamp, revision) in enumerate(self._revisions()):
+			curr_text = revision[element_type]
+			if remove_vandalism: reverts.add(utils.state_fingerprint(revision, [element_type]))
+			diff = utils.diff_texts(prev_text, curr_text, spans=spans)
+			curr_total = prev_total + diff[0] - diff[1]
 			totals.append(curr_total)
+			prev_text, prev_total = curr_text, curr_total
 
 			if curr_total == 0:
 				added.append(0)
@@ -152,24 +228,19 @@ class Analyze:
 				removed.append(0)
 
 			else:
-				curr = [x.lower() for x in self.data[self.timestamps[n]][element_type].split()]
-				prev = [x.lower() for x in self.data[self.timestamps[n-1]][element_type].split()]
-
-				# TODO: do Levensteihn or something more complicated on sentences, 
-				# to detect whether there is both additions and removals. And what they are.
-				diff = len(curr) - len(prev)
-				if diff == 0:
-					added.append(0)
-					removed.append(0)
-				elif diff < 0:
-					added.append(0)
-					removed.append(diff) #/curr_total)
-				elif diff > 0:
-					added.append(diff) #/curr_total)
-					removed.append(0)
+				added.append(diff[0])
+				removed.append(-diff[1])
+				if spans: changed_spans[timestamp] = diff[2]
+
+		if remove_vandalism:
+			mask = reverts.mask()
+			self._remove_reverts(mask, added, removed)
+			for n in np.flatnonzero(mask):
+				changed_spans.pop(self.timestamps[n], None)
 
 		if visualize:
-			y = [datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ") for ts in self.timestamps]
-			uviz.plot_changes(y, added, removed, totals, self.topic, self.language, element_type)
+			y = self.index.datetimes()
+			uviz.plot_changes(y, added, removed, totals, self.topic, self.language, element_type, renderer=self.renderer)
 
+		if spans: return added, removed, totals, changed_spans
 		return added, removed, totals
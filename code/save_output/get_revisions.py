@@ -5,19 +5,22 @@
 	Output: JSON with parsed and tokenized revision histories. One file per language.
 """
 import argparse
+import utils_fetch
 import utils_io as uio
-from WikiRevParser.wikirevparser import wikirevparser
 
 argsparser = argparse.ArgumentParser(description='''Get and parse edit histories of Wikipedia language versions.''')
 argsparser.add_argument("event", help="e.g. 'refugee_crisis'.")
 argsparser.add_argument("--language", help="e.g. 'da'. (for debugging)")
 argsparser.add_argument("--check_os", default="y", help="e.g. 'y'. (for debugging)")
+argsparser.add_argument("--jobs", default=4, type=int, help="e.g. 4. Number of languages fetched at once.")
+argsparser.add_argument("--rate", default=1/3, type=float, help="e.g. 0.33. Fetches started per second across all languages.")
 
 args = argsparser.parse_args()
 
 def get_data():
 
 	input_data = open("resources/events/%s.txt" % args.event).readlines()
+	language_titles = {}
 
 	for line in sorted(input_data):
 		try:
@@ -34,15 +37,12 @@ def get_data():
 			else:
 				print(args.event, language)
 		
-		print("\nLanguage:\t", language)
-		print("Title:\t\t", title)
-
-		parser_instance = wikirevparser.ProcessRevisions(language, title)
+		language_titles[language] = title
 
-		page = parser_instance.wikipedia_page()
-		if page == None: continue
+	for language, data in utils_fetch.fetch_languages(language_titles, jobs=args.jobs, rate=args.rate):
+		print("\nLanguage:\t", language)
+		print("Title:\t\t", language_titles[language])
 
-		data = parser_instance.parse_revisions()
 		if data == None: continue
 
 		uio.save_to_json(args.event, language, data)
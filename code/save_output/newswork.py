@@ -8,11 +8,14 @@
 import argparse
 import numpy as np
 import revision_analysis
+import utils
 import utils_io as uio
+import utils_profile as uprof
+import utils_time
 import utils_visualization as uviz
 
-from collections import Counter, defaultdict, OrderedDict
-from datetime import datetime
+from collections import defaultdict, OrderedDict
+from functools import partial
 from Levenshtein import distance as levenshtein_distance
 from operator import itemgetter
 from sklearn import preprocessing
@@ -24,6 +27,12 @@ parser.add_argument("--users", default="y")
 parser.add_argument("--temporal", default="y")
 parser.add_argument("--language", help="e.g. 'nl' (for debugging).")
 parser.add_argument("--visualize", default="y", help="e.g. 'y' (for debugging).")
+parser.add_argument("--jobs", default=1, type=int, help="e.g. 4. Number of languages analysed in parallel.")
+parser.add_argument("--plot_jobs", default=2, type=int, help="e.g. 4. Number of processes rendering plots while the analysis continues.")
+parser.add_argument("--profile", default="n", help="e.g. 'y', or 'memory' to also trace the peak memory. Time each stage per language, and save a report to data/profiles/.")
+parser.add_argument("--bins", default="day", help="e.g. 'hour' or 'week'. Time bins in which the languages are compared.")
+parser.add_argument("--checkpoint", default="n", help="e.g. 'y'. Resume link and url analyses from the last processed revision.")
+parser.add_argument("--remove_reverts", default="n", help="e.g. 'y'. Leave the changes of reverted revisions and of their reverts out of the content, link and url changes.")
 
 args = parser.parse_args()
 
@@ -31,113 +40,143 @@ elements = ["content", "links", "urls"] #, "images", "categories"]
 languages = [l for l in uio.get_language(args.event)] 
 
 all_languages_totals = OrderedDict()
-all_languages_dates = dict()
-total_edits_all_languages = []
+all_languages_epochs = dict()
+renderer = uviz.PlotRenderer(args.plot_jobs)
+profiler = uprof.Profiler(args.profile)
 
 user_info = []
 headers = ["Language", "# of editors", "# of edits", "Average # of edits/editor", "# of one-time editors", "length of article"]
 
-def get_edits_per_date(timestamps):
-	edits_per_date = Counter()
-	dates = [datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ").strftime("%m-%d-%Y") for timestamp in sorted(timestamps)]
-	
-	for dt in dates:
-		edits_per_date[dt] += 1
-
-	y = [datetime.strptime(dt, "%m-%d-%Y") for dt in edits_per_date.keys()]
-
-	return y, list(edits_per_date.values())
-
 def print_user_info(list_of_lists, headers):
 
 	table = sorted(list_of_lists, key=itemgetter(1))
 	print(tabulate(table, headers, tablefmt="latex"))
 
-def perform_analyses(visualize=False):
+def print_edit_frequencies(bin_dates, edits):
+	""" Edits per language in the shared time bins: the bins with edits and the busiest bin. """
 
-	edit_frequencies = []
-	edit_dates = []
-	for language in languages:
-		if args.language:
-			if language != args.language: continue
+	table = []
+	for language, language_edits in zip(languages, edits):
+		peak = int(np.argmax(language_edits))
+		active = round(np.count_nonzero(language_edits)/len(bin_dates)*100, 1)
+		table.append([language, int(language_edits.sum()), active, bin_dates[peak].isoformat(), int(language_edits[peak])])
 
-		input_data = uio.open_file(args.event, language)
-		if input_data == None: 
-			languages.remove(language)
-			continue
-		directory_name = "visualizations/%s/" % args.event
-		uio.mkdirectory(directory_name)
+	headers = ["Language", "# of edits", "%% of %ss with edits" % args.bins, "Busiest %s" % args.bins, "# of edits then"]
+	print(tabulate(sorted(table, key=itemgetter(1)), headers, tablefmt="latex"))
 
-		ra = revision_analysis.Analyze(input_data, language, args.event, daily=True)
+def analyse_language(language, visualize=False):
+	""" Perform the analyses of one language. Returns None if there is no data for the language. """
 
-		if language not in all_languages_dates.keys():
-			language_timestamps = ra.timestamps
+	input_data = uio.open_file(args.event, language, stream=True)
+	if input_data == None: return None
 
-			all_languages_dates[language] = language_timestamps
-		l_dates, l_edits = get_edits_per_date(ra.timestamps)
-		edit_frequencies.append(l_edits)
-		edit_dates.append(l_dates)
-	
-		# # - - - - Perform analyses per element - - - - 
-
-		# todo: "sections" have a bad format for now: [[],[],[]]
-		totals_temporal = []
-		added_temporal = []
-		removed_temporal = []
-		analysis_data = defaultdict()
-
-		if args.visualize == "y":
-			visualize = True
-
-		for element in elements:
-			if element == "content": 
-				added, removed, totals = ra.string_development(element, visualize=visualize)
-			else: 
-				added, removed, totals = ra.list_development(element, remove_vandalism=True, visualize=visualize)
-			analysis_data[element] = [added,removed]
-			totals_temporal.append(totals)
-			added_temporal.append(added)
-			removed_temporal.append(removed)
-
-		all_languages_totals[language] = totals_temporal
+	directory_name = "visualizations/%s/" % args.event
+	uio.mkdirectory(directory_name)
+
+	# plot jobs are rendered by the main process
+	plots = uviz.PlotRenderer(jobs=0)
+	with profiler.stage("read timestamps", language) as record:
+		ra = revision_analysis.Analyze(input_data, language, args.event, daily=True, renderer=plots)
+		record["revisions"] = len(ra.timestamps)
+
+	language_timestamps = ra.timestamps
+
+	# # - - - - Perform analyses per element - - - - 
+
+	# todo: "sections" have a bad format for now: [[],[],[]]
+	totals_temporal = []
+	added_temporal = []
+	removed_temporal = []
+	analysis_data = defaultdict()
+
+	if args.visualize == "y":
+		visualize = True
+
+	for element in elements:
+		if element == "content": 
+			with profiler.stage("string_development %s" % element, language, len(ra.timestamps)):
+				added, removed, totals = ra.string_development(element, remove_vandalism=args.remove_reverts == "y", visualize=visualize)
+		else: 
+			with profiler.stage("list_development %s" % element, language, len(ra.timestamps)):
+				added, removed, totals = ra.list_development(element, remove_vandalism=args.remove_reverts == "y", visualize=visualize, checkpoint=args.checkpoint == "y")
+		analysis_data[element] = [added,removed]
+		totals_temporal.append(totals)
+		added_temporal.append(added)
+		removed_temporal.append(removed)
+
+	with profiler.stage("get_users", language, len(ra.timestamps)):
 		users = ra.get_users()
-		total_edits = sum(users.values())
-		total_users = len(users)
-		average = round(total_edits/total_users,0)
-		singletime_editors = round((len([k for (k,v) in users.items() if v == 1])/total_users)*100,1)
+	total_edits = int(users.sum())
+	total_users = len(users)
+	average = round(total_edits/total_users,0)
+	singletime_editors = round((np.count_nonzero(users == 1)/total_users)*100,1)
 
-		user_info.append([language, total_users, total_edits, average, singletime_editors, totals[-1]])
-		
-		#- - - - Temporal overview all elements - - - - -  
+	#- - - - Temporal overview all elements - - - - -  
 
-		if args.temporal == "y":
+	if args.temporal == "y":
+		with profiler.stage("temporal overview", language, len(language_timestamps)):
 			# Added/Removed over time for all elements
-			y = [datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ") for ts in language_timestamps]
-			uviz.plot_article_development(y, analysis_data.values(), elements, args.event, language, "article_changes")
+			y = ra.index.datetimes()
+			uviz.plot_article_development(y, analysis_data.values(), elements, args.event, language, "article_changes", renderer=plots)
 
 			# General development of article over time, needs scaling to accomodate the differences in scope
 			mm_scaler = preprocessing.MinMaxScaler()
 			scaled_totals = [mm_scaler.fit_transform(np.array(x).reshape(-1, 1)) for x in totals_temporal]
-			try:
-				uviz.plot_article_development(y, scaled_totals, elements, args.event, language, "article_development")
-			except ValueError as err:
-				pass
-				print("Couldn't plot article development because:\t", err)
-	print_user_info(user_info, headers)
-	uviz.plot_element_across_languages(edit_dates, edit_frequencies, "edit frequency", languages, args.event)
+			uviz.plot_article_development(y, scaled_totals, elements, args.event, language, "article_development", renderer=plots)
+
+	return {
+		"language": language,
+		"timestamps": language_timestamps,
+		"epochs": ra.index.epochs,
+		"totals_temporal": totals_temporal,
+		"user_info": [language, total_users, total_edits, average, singletime_editors, totals[-1]],
+		"plots": plots.collected,
+		"profile": profiler.collect()
+	}
+
+def perform_analyses(visualize=False):
+	""" Analyse all languages, on args.jobs processes, and merge the results in language order. """
+
+	if args.language:
+		languages[:] = [language for language in languages if language == args.language]
+
+	results = utils.map_languages(partial(analyse_language, visualize=visualize), list(languages), args.jobs)
+	for language, result in zip(list(languages), results):
+		if result == None:
+			languages.remove(language)
+			continue
+
+		all_languages_epochs[language] = result["epochs"]
+		all_languages_totals[language] = result["totals_temporal"]
+		user_info.append(result["user_info"])
+		renderer.submit_all(result["plots"])
+		# stages recorded in a worker process
+		profiler.extend(result["profile"])
+
+	with profiler.stage("print_user_info"):
+		print_user_info(user_info, headers)
+
+	# the edits of all languages in the same bins, including the bins without edits
+	with profiler.stage("resample edits"):
+		bin_dates, edits = utils_time.resample([all_languages_epochs[language] for language in languages], args.bins)
+	if len(bin_dates) == 0: return
+	print_edit_frequencies(bin_dates, edits)
+	uviz.plot_element_across_languages([bin_dates] * len(languages), edits, "edit frequency", languages, args.event, renderer=renderer)
 	
 def comparative():
-	for n, element in enumerate(elements):
-		plotting_data = []
-		for language in comparative_languages: 
-			if args.language:
-				if language != args.language: continue
-				language = args.language
+	""" Compare the development of each element across languages, with the totals at the end of each shared time bin. """
 
-			lang_data = all_languages_totals[language][n]
-			plotting_data.append(lang_data)
-		uviz.plot_element_across_languages(all_languages_dates, plotting_data, element, languages, args.event)
+	epochs = [all_languages_epochs[language] for language in languages]
+	for n, element in enumerate(elements):
+		with profiler.stage("resample %s" % element):
+			bin_dates, totals = utils_time.resample_last(epochs, [all_languages_totals[language][n] for language in languages], args.bins)
+		if len(bin_dates) == 0: continue
+		uviz.plot_element_across_languages([bin_dates] * len(languages), totals, element, languages, args.event, renderer=renderer)
 
 if __name__ == "__main__":
 	perform_analyses()
 	comparative()
+	# waits for the plots that are still rendering
+	with profiler.stage("render plots"):
+		renderer.close()
+	profiler.report("newswork_%s" % args.event)
@@ -12,12 +12,14 @@
 import argparse
 import glob
 import matplotlib.pyplot as plt
+import numpy as np
 import os
 import plotly.graph_objects as go
 import string
-import re
 import revision_analysis
+import utils
 import utils_io as uio
+import utils_profile as uprof
 import utils_visualization as uviz
 
 from collections import Counter, defaultdict, OrderedDict
@@ -29,31 +31,51 @@ parser.add_argument("event", help="e.g. 'covid19'.")
 parser.add_argument("--language", help="e.g. 'nl' (for debugging).")
 parser.add_argument("--visualize", default="n")
 parser.add_argument("--check_os", default="y")
+parser.add_argument("--jobs", default=1, type=int, help="e.g. 4. Number of languages analysed in parallel.")
+parser.add_argument("--plot_jobs", default=2, type=int, help="e.g. 4. Number of processes rendering plots while the analysis continues.")
+parser.add_argument("--profile", default="n", help="e.g. 'y', or 'memory' to also trace the peak memory. Time each stage per language, and save a report to data/profiles/.")
+parser.add_argument("--save_results", default="n", help="e.g. 'y'. Save the result of each language to data/<event>/results/. With --language, only the result (and plots) of that language are made.")
+parser.add_argument("--from_results", default="n", help="e.g. 'y'. Make the tables and plots from the saved results instead of analysing the languages.")
+parser.add_argument("--remove_reverts", default="n", help="e.g. 'y'. Leave the revisions in reverted spans (marked by covid19_data.py) out of the edit and change statistics.")
+parser.add_argument("--columnar", default="n", help="e.g. 'y'. Read the columnar output, converting the JSON output first if needed.")
 
 args = parser.parse_args()
 
 directory = "data/%s/*.json" % args.event
 
+WIKIPEDIAN_TYPES = utils.WIKIPEDIAN_TYPES
+EDIT_TYPES = ["content", "editorial"]
+
+registry = utils.EditorRegistry("data/%s/registry/editors.json" % args.event)
+profiler = uprof.Profiler(args.profile)
+
 def get_wikipedian_type(wikipedian):
 	""" determine whether a wikipedian is registered, anonymous or bot """
-	IP = re.search(r"([0-9]+[:.]+)+", wikipedian)
-	if IP != None: wikipedian_type = "anonymous"
-	elif wikipedian.lower().endswith("bot"): 
-		wikipedian_type = "bot"
-	else: wikipedian_type = "registered"
-	return wikipedian_type
+	return WIKIPEDIAN_TYPES[utils.get_wikipedian_type_code(wikipedian)]
 
 def process_data(input_data):
-	""" Get the values for each key in input data. Output is a dictionary with all y in Y in a list. """
+	""" Get the values for each key in input data. Output is a dictionary with all y in Y in a list. 
+	The input data is read in a single pass, so it can be a uio.RevisionStream. 
+	Wikipedians are also encoded as editor IDs and type codes of the shared registry.
+	The reverted mask is True for the revisions in reverted spans, if --remove_reverts is "y". """
 
 	processed_data = {
-		"content_sizes": [input_data[timestamp]["words"] for timestamp in input_data],
-		"edit_types": [input_data[timestamp]["edit_type"] for timestamp in input_data],
-		"wikipedians": [input_data[timestamp]["wikipedian"] for timestamp in input_data],
-		"wikipedian_types": []
+		"timestamps": [],
+		"content_sizes": [],
+		"edit_types": [],
+		"wikipedians": [],
+		"reverted": []
 	}
-	for wikipedian in processed_data["wikipedians"]:
-		processed_data["wikipedian_types"].append(get_wikipedian_type(wikipedian))
+	for timestamp, revision in input_data.items():
+		processed_data["timestamps"].append(timestamp)
+		processed_data["content_sizes"].append(revision["words"])
+		processed_data["edit_types"].append(revision["edit_type"])
+		processed_data["wikipedians"].append(revision["wikipedian"])
+		processed_data["reverted"].append(revision.get("reverted", False))
+
+	processed_data["wikipedian_ids"], processed_data["wikipedian_type_codes"] = registry.encode(processed_data["wikipedians"])
+	processed_data["wikipedian_types"] = [WIKIPEDIAN_TYPES[code] for code in processed_data["wikipedian_type_codes"]]
+	processed_data["reverted"] = np.array(processed_data["reverted"], dtype=bool) & (args.remove_reverts == "y")
 
 	return processed_data
 
@@ -75,7 +97,8 @@ def get_wikipedian_edits_dist(data):
 		"editorial": Counter()
 	}
 
-	for e, w in zip(data["edit_types"], data["wikipedian_types"]):
+	for e, w, reverted in zip(data["edit_types"], data["wikipedian_types"], data["reverted"]):
+		if reverted: continue
 		edit_wikipedian[w][e] += 1
 		wikipediantype_edit[e][w] += 1
 
@@ -96,127 +119,72 @@ def get_wikipedian_edits_dist(data):
 	return edit_wikipedian, wikipediantype_edit
 
 
+def get_type_codes(values, types):
+	""" Encode a list of categories as an array of indices into types (-1 for anything else). """
+	codes = {t: n for n, t in enumerate(types)}
+	return np.array([codes.get(v, -1) for v in values], dtype=np.int8)
+
+def get_edit_type_codes(data):
+	""" The edit type codes of the revisions, with -1 for reverted revisions, so they are not counted. """
+	edit_types = get_type_codes(data["edit_types"], EDIT_TYPES)
+	edit_types[data["reverted"]] = -1
+	return edit_types
+
 def get_diachronic_wikipedians(data):
-	""" edit types per wikipedia type over time """
-	
-	totals = {
-		"content": 0,
-		"editorial": 0,
-		"anon_content": 0,
-		"anon_editorial": 0,
-		"reg_content": 0,
-		"reg_editorial": 0,
-		"bot_content": 0,
-		"bot_editorial": 0
-	}
-	wikipedian_edit_diachronic = {
-		"anon_content": [],
-		"anon_editorial": [],
-		"reg_content": [],
-		"reg_editorial": [],
-		"bot_content": [],
-		"bot_editorial": []
-	}
-	for e, w in zip(data["edit_types"], data["wikipedian_types"]):
-
-		if e == "content":
-			if w == "anonymous": 
-				totals["anon_content"] += 1
-			elif w == "registered":
-				totals["reg_content"] += 1
-			elif w == "bot":
-				totals["bot_content"] += 1
-			totals["content"] += 1
-
-		elif e == "editorial":
-			if w == "anonymous": 
-				totals["anon_editorial"] += 1
-			elif w == "registered":
-				totals["reg_editorial"] += 1
-			elif w == "bot":
-				totals["bot_editorial"] += 1
-			totals["editorial"] += 1
-
-		if totals["content"] == 0:
-			wikipedian_edit_diachronic["anon_content"].append(0)
-			wikipedian_edit_diachronic["reg_content"].append(0)
-			wikipedian_edit_diachronic["bot_content"].append(0)
-		else:
-			wikipedian_edit_diachronic["anon_content"].append(totals["anon_content"]/totals["content"])
-			wikipedian_edit_diachronic["reg_content"].append(totals["reg_content"]/totals["content"])
-			wikipedian_edit_diachronic["bot_content"].append(totals["bot_content"]/totals["content"])
-		
-		if totals["editorial"] == 0:
-			wikipedian_edit_diachronic["anon_editorial"].append(0)
-			wikipedian_edit_diachronic["reg_editorial"].append(0)
-			wikipedian_edit_diachronic["bot_editorial"].append(0)
-		else:
-			wikipedian_edit_diachronic["anon_editorial"].append(totals["anon_editorial"]/totals["editorial"])
-			wikipedian_edit_diachronic["reg_editorial"].append(totals["reg_editorial"]/totals["editorial"])
-			wikipedian_edit_diachronic["bot_editorial"].append(totals["bot_editorial"]/totals["editorial"])
+	""" edit types per wikipedia type over time. The shares are running sums divided by the running number of edits of each edit type. """
+
+	edit_types = get_edit_type_codes(data)
+	wikipedian_types = data["wikipedian_type_codes"]
+
+	totals = {e: np.cumsum(edit_types == e) for e in range(len(EDIT_TYPES))}
+
+	wikipedian_edit_diachronic = {}
+	for w, prefix in [(1, "anon"), (0, "reg"), (2, "bot")]:
+		for e, edit_type in enumerate(EDIT_TYPES):
+			counts = np.cumsum((edit_types == e) & (wikipedian_types == w))
+			shares = np.divide(counts, totals[e], out=np.zeros(len(counts)), where=totals[e] > 0)
+			wikipedian_edit_diachronic[f"{prefix}_{edit_type}"] = shares.tolist()
 
 	return wikipedian_edit_diachronic
 
 
 def get_content_development(data, timestamps):
-	""" content development and deletion/additions per wikipedian type. Makes data for table and plot"""
+	""" content development and deletion/additions per wikipedian type. Makes data for table and plot.
+	The content sizes are those of all revisions, the changes of reverted revisions are left out. """
+	content_sizes = np.array(data["content_sizes"], dtype=np.int64)
+	wikipedian_types = data["wikipedian_type_codes"]
+
+	# the first revision adds all of its content
+	changes = np.diff(content_sizes, prepend=0)
+	is_addition = changes > 0
+	is_deletion = changes < 0
+	if len(changes) > 0:
+		changes[0] = content_sizes[0]
+		is_addition[0] = True
+	is_addition &= ~data["reverted"]
+	is_deletion &= ~data["reverted"]
+	additions = np.where(is_addition, changes, 0)
+	deletions = np.where(is_deletion, -changes, 0)
+
 	content_information = {
-		"content_sizes": [],
+		"content_sizes": content_sizes.tolist(),
 		"addition_magnitude": Counter(),
 		"addition_count": Counter(),
 		"deletion_magnitude": Counter(),
-		"deletion_count": Counter(),
-		"registered_add": [],
-		"anonymous_add": [],
-		"bot_add": [],
-		"registered_del": [],
-		"anonymous_del": [],
-		"bot_del": []
+		"deletion_count": Counter()
 	}
-	total_non_magnitude_change = 0
 
-	for n, s in enumerate(data["content_sizes"]):
-		#print(s, "\tat timestamp:\t", timestamps[n], "(", n, ")")
-		content_information["content_sizes"].append(s)
+	for w, wikipedian in enumerate(WIKIPEDIAN_TYPES):
+		is_wikipedian = wikipedian_types == w
+		content_information[f"{wikipedian}_add"] = np.where(is_wikipedian, additions, 0).tolist()
+		content_information[f"{wikipedian}_del"] = np.where(is_wikipedian, deletions, 0).tolist()
 
-		wikipedian = data["wikipedian_types"][n]
-		other_wikipedians = [t for t in ["registered", "anonymous", "bot"] if t != wikipedian]
-		
 		# this is for making a table
-		if n == 0: 
-			content_information["addition_magnitude"][wikipedian] += s
-			content_information["addition_count"][wikipedian] += 1
-			content_information[f"{wikipedian}_add"].append(s)
-			content_information[f"{wikipedian}_del"].append(0)
-
-			for wikipedian_type in other_wikipedians:
-				content_information[f"{wikipedian_type}_add"].append(0)
-				content_information[f"{wikipedian_type}_del"].append(0)
-			continue
-
-		previous_size = data["content_sizes"][n-1]
-
-		if s < previous_size:
-			content_information["deletion_magnitude"][wikipedian] += previous_size - s
-			content_information["deletion_count"][wikipedian] += 1
-			content_information[f"{wikipedian}_del"].append(data["content_sizes"][n-1] - s)
-			#if wikipedian == "registered":
-			print("deletion:\t", timestamps[n], previous_size, s, s - previous_size)
-		else:
-			content_information[f"{wikipedian}_del"].append(0)
-
-		if s > previous_size:
-			content_information["addition_magnitude"][wikipedian] += s - previous_size
-			content_information["addition_count"][wikipedian] += 1
-			content_information[f"{wikipedian}_add"].append(s - data["content_sizes"][n-1])
-			#if wikipedian == "anonymous":
-			#	print("addition:\t", timestamps[n], previous_size, s, s - previous_size)
-		else:
-			content_information[f"{wikipedian}_add"].append(0)
-		
-		for wikipedian_type in other_wikipedians:
-			content_information[f"{wikipedian_type}_add"].append(0)
-			content_information[f"{wikipedian_type}_del"].append(0)
+		for evaluation, is_change, magnitudes in [("addition", is_addition, additions), ("deletion", is_deletion, deletions)]:
+			count = int(np.count_nonzero(is_change & is_wikipedian))
+			if count == 0: continue
+			content_information[f"{evaluation}_count"][wikipedian] = count
+			content_information[f"{evaluation}_magnitude"][wikipedian] = int(magnitudes[is_wikipedian].sum())
 
 	return content_information
 
@@ -252,24 +220,15 @@ def add_to_table(language, content_information, evaluation="deletion"):
 	return language_list
 
 def get_wikipedian_information(data):
-	""" Wikipedian distributions """
-	wikipedian_edit = {}
-	edit_wikipedian = {
-		"editorial": Counter(),
-		"content": Counter()
-	}
-	for e, w in zip(data["edit_types"], data["wikipedians"]):
-		if w not in wikipedian_edit:
-			wikipedian_edit[w] = Counter()
-		wikipedian_edit[w][e] += 1
+	""" Wikipedian distributions, counted per editor ID """
+	edit_types = get_edit_type_codes(data)
 
-	for e, w in zip(data["edit_types"], data["wikipedians"]):
-		edit_wikipedian[e][w] += 1
+	for edit_type in ["editorial", "content"]:
+		edits = np.bincount(data["wikipedian_ids"][edit_types == EDIT_TYPES.index(edit_type)])
+		top = [i for i in np.argsort(-edits, kind="stable")[:10] if edits[i] > 0]
 
-	print("\n********** Top 10 editorial contributors ********** \t", edit_wikipedian["editorial"].most_common(10))
-	print()
-	print("\n********** Top 10 content contributors ********** \t", edit_wikipedian["content"].most_common(10))
-	print()
+		print(f"\n********** Top 10 {edit_type} contributors ********** \t", [(registry.names[i], int(edits[i])) for i in top])
+		print()
 
 def get_continents(languages):
 	continent_data = open(f"resources/events/covid19.tsv").readlines()
@@ -301,68 +260,138 @@ def get_continents(languages):
 
 	return colors, continents
 
-def main():
-
-	header1 = ["Language", "Registered", "", "Anonymous", "", "Bot", "", "total count"]
-	header2 = ["", "CP", "MP", "CP", "MP", "CP", "MP", ""]
-	deletion_table = [header2]
-	addition_table = [header2]
-	creation_time = dict()
+def analyse_language(filename):
+	""" Analyse and plot one language. Returns None for skipped languages, otherwise the creation time and table rows. """
 
-	too_small_languages = set()
+	language = filename.split("/")[-1].split(".")[0]
+	if args.language:
+		if language != args.language: return None
 
-	for filename in sorted(glob.glob(directory)):
+	print("\nLanguage:\t", language)
 
-		language = filename.split("/")[-1].split(".")[0]
-		if args.language:
-			if language != args.language: continue
+	if args.check_os == "y":
+		if os.path.isfile(f"visualizations/{args.event}/content_magnitude/{language}.png"):
+			print(f"{language} has already been analyzed, moving on...")
+			return None
 
-		print("\nLanguage:\t", language)
+	known_editors = len(registry.names)
 
-		if args.check_os == "y":
-			if os.path.isfile(f"visualizations/{args.event}/content_magnitude/{language}.png"):
-				print(f"{language} has already been analyzed, moving on...")
-				continue
+	if args.columnar == "y":
+		if uio.read_columnar(args.event, language) is None:
+			with profiler.stage("convert to columnar", language):
+				uio.save_columnar(args.event, language, uio.read_from_json(filename))
+		input_data = uio.read_columnar(args.event, language)
+	else:
+		input_data = uio.RevisionStream(filename)
 
-		input_data = uio.read_from_json(filename)
-		timestamps = list(input_data.keys())
+	# reading the input is part of process_data, since the input is streamed
+	with profiler.stage("process_data", language) as record:
 		data = process_data(input_data)
-		creation_time[language] = (timestamps[0], data["wikipedian_types"][0])
-		
-		if len(timestamps) < 100: 
-			too_small_languages.add((language, len(timestamps)))
-			continue
-		
-		# """ WIKIPEDIANS """
+		record["revisions"] = len(data["timestamps"])
+	timestamps = data["timestamps"]
+
+	result = {
+		"language": language,
+		"creation_time": (timestamps[0], data["wikipedian_types"][0]),
+		"too_small": None,
+		"new_editors": registry.names[known_editors:],
+		"deletion": None,
+		"addition": None,
+		"plots": [],
+		"profile": []
+	}
+	
+	if len(timestamps) < 100: 
+		result["too_small"] = (language, len(timestamps))
+		result["profile"] = profiler.collect()
+		return result
+	
+	# """ WIKIPEDIANS """
+	with profiler.stage("get_wikipedian_information", language, len(timestamps)):
 		get_wikipedian_information(data)
 
-		# # distributions of wikipedian/edits and edits/wikipedian
+	# # distributions of wikipedian/edits and edits/wikipedian
+	with profiler.stage("get_wikipedian_edits_dist", language, len(timestamps)):
 		edit_wikipedian, wikipedian_edit = get_wikipedian_edits_dist(data)
 
-		# # over time
+	# plot jobs are rendered by the main process
+	plots = uviz.PlotRenderer(jobs=0)
+
+	# # over time
+	with profiler.stage("get_diachronic_wikipedians", language, len(timestamps)):
 		wikipedian_edit_diachronic = get_diachronic_wikipedians(data)
-		uviz.plot_wikipedian_edittypes(wikipedian_edit_diachronic, timestamps, args.event, language)
+	uviz.plot_wikipedian_edittypes(wikipedian_edit_diachronic, timestamps, args.event, language, renderer=plots)
 
-		""" CONTENT """
+	""" CONTENT """
+	with profiler.stage("get_content_development", language, len(timestamps)):
 		content_information = get_content_development(data, timestamps)
-		uviz.plot_content_magnitude(content_information["content_sizes"], timestamps, args.event, language)
-		uviz.plot_additions_deletions_per_wikipediantype(content_information, timestamps, args.event, language)
+	uviz.plot_content_magnitude(content_information["content_sizes"], timestamps, args.event, language, renderer=plots)
+	uviz.plot_additions_deletions_per_wikipediantype(content_information, timestamps, args.event, language, renderer=plots)
+	
+	result["plots"] = plots.collected
+	with profiler.stage("add_to_table", language, len(timestamps)):
+		result["deletion"] = add_to_table(language, content_information)
+		result["addition"] = add_to_table(language, content_information, evaluation="addition")
+	result["profile"] = profiler.collect()
+	return result
+
+def main():
+
+	header1 = ["Language", "Registered", "", "Anonymous", "", "Bot", "", "total count"]
+	header2 = ["", "CP", "MP", "CP", "MP", "CP", "MP", ""]
+	deletion_table = [header2]
+	addition_table = [header2]
+	creation_time = dict()
+
+	too_small_languages = set()
+	renderer = uviz.PlotRenderer(args.plot_jobs)
+
+	if args.from_results == "y":
+		results = uio.read_results(args.event)
+	else:
+		results = utils.map_languages(analyse_language, sorted(glob.glob(directory)), args.jobs)
+
+	for result in results:
+		if result == None: continue
+		if args.save_results == "y":
+			uio.save_result(args.event, result["language"], result)
+
+		language = result["language"]
+		creation_time[language] = result["creation_time"]
+		# stages recorded in a worker process
+		profiler.extend(result["profile"])
+
+		# editors registered in a worker process
+		for name in result["new_editors"]:
+			registry.register(name)
 		
+		if result["too_small"] != None: 
+			too_small_languages.add(tuple(result["too_small"]))
+			continue
+		
+		renderer.submit_all(result["plots"])
+
 		# Deletion
-		language_list = add_to_table(language, content_information)
-		if language_list != None:
-			deletion_table.append(language_list)
+		if result["deletion"] != None:
+			deletion_table.append(result["deletion"])
 
 		# Addition
-		language_list = add_to_table(language, content_information, evaluation="addition")
-		if language_list != None:
-			addition_table.append(language_list)
+		if result["addition"] != None:
+			addition_table.append(result["addition"])
+
+	# a single saved language, e.g. a per-language pipeline task: the tables, the creation times and the editor registry
+	# are shared by all languages, so they are left to a run with --from_results y
+	if args.save_results == "y" and args.language:
+		with profiler.stage("render plots"):
+			renderer.close()
+		return
 	
 	#DELETION and ADDITION tables
-	print("\n********** Deletions **********")
-	print(tabulate(deletion_table, headers=header1, tablefmt="latex"))
-	print("\n********** Additions **********")
-	print(tabulate(addition_table, headers=header1, tablefmt="latex"))
+	with profiler.stage("tabulate"):
+		print("\n********** Deletions **********")
+		print(tabulate(deletion_table, headers=header1, tablefmt="latex"))
+		print("\n********** Additions **********")
+		print(tabulate(addition_table, headers=header1, tablefmt="latex"))
 
 	print("\n\n")
 	sorted_creation_times ={k: v for k, v in sorted(creation_time.items(), key=lambda item: item[1])} 
@@ -374,9 +403,15 @@ def main():
 	print()
 
 	colors, continents = get_continents(languages)
-	uviz.plot_creation_time(creation_times, languages, colors, continents)
+	with profiler.stage("plot_creation_time"):
+		uviz.plot_creation_time(creation_times, languages, colors, continents)
+	# waits for the plots that are still rendering
+	with profiler.stage("render plots"):
+		renderer.close()
 
 	print("%s languages have < 100 edits:" % len(too_small_languages), too_small_languages)
+	registry.save()
+	profiler.report("covid19_analyse_%s" % args.event)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -7,6 +7,7 @@
 	- size of content
 	- editor (name or IP adress)
 	- edit type (e.g. content or style edit)
+	- whether the revision is in a reverted span (only stored when it is)
 
 	Output: JSON file where each entry is a revision.
 """
@@ -15,20 +16,25 @@ import argparse
 import os
 import re
 import revision_analysis
-import string
-import time
+import utils
+import utils_fetch
 import utils_io as uio
+import utils_profile as uprof
 import utils_visualization as uviz
 
 from collections import Counter, defaultdict, OrderedDict
-from WikiRevParser.wikirevparser import wikirevparser
 
 parser = argparse.ArgumentParser(description='''Extracts specific information per revision of a Wikipedia page. To overcome data storage issues, the revision histories are not saved, only the extracted information. Used for COVID19 analysis''')
 parser.add_argument("event", help="e.g. 'covid19'.")
 parser.add_argument("--language", help="e.g. 'nl' (for debugging).")
 parser.add_argument("--check_os", default="y")
+parser.add_argument("--update", default="n", help="e.g. 'y'. Append the revisions newer than the stored output instead of skipping or redoing a language.")
+parser.add_argument("--jobs", default=4, type=int, help="e.g. 4. Number of languages fetched at once.")
+parser.add_argument("--rate", default=1/3, type=float, help="e.g. 0.33. Fetches started per second across all languages.")
+parser.add_argument("--profile", default="n", help="e.g. 'y', or 'memory' to also trace the peak memory. Time each stage per language, and save a report to data/profiles/.")
 
 args = parser.parse_args()
+profiler = uprof.Profiler(args.profile)
 
 def get_language_titles():
 	""" Extract language and title from input file. """
@@ -49,20 +55,6 @@ def get_language_titles():
 
 	return language_titles
 
-def get_revisions(language, title):
-	""" Extract and parse Wikipedia revision history for given language and title. """
-
-	time.sleep(3)
-	parser_instance = wikirevparser.ProcessRevisions(language, title)
-
-	page = parser_instance.wikipedia_page()
-	if page == None: return None
-
-	revisions = parser_instance.parse_revisions()
-	if revisions == None: return None
-
-	return revisions
-
 def determine_edit_type(values, previous_values):
 	""" Determine whether an edit is editorial (0) or content (1). 
 	This is dependent on whether there are substantial additions in content volume. 
@@ -87,11 +79,27 @@ def determine_edit_type(values, previous_values):
 	else:
 		return "editorial"
 
-def get_values(revision):
-	""" Get the values to determine edit type (editorial or content). """
+REVERT_FIELDS = ["content", "images", "links", "urls", "categories"]
+
+def mark_reverts(language, reverted):
+	""" Mark the revisions that were undone by a later revision, and the revisions that undid them, with "reverted": True.
+	The output file is rewritten as a stream, so only one record is in memory at a time. """
+
+	if len(reverted) == 0: return
+	reverted = set(reverted)
+
+	file_name = "data/%s/%s.json" % (args.event, language)
+	with uio.JSONWriter(args.event, language) as writer:
+		for timestamp, timestamp_output in uio.iter_json_items(file_name):
+			if timestamp in reverted: timestamp_output["reverted"] = True
+			writer.write(timestamp, timestamp_output)
+
+def get_values(revision, word_counter=None):
+	""" Get the values to determine edit type (editorial or content). 
+	With a utils.WordCounter, the words are counted from the changes to the previous revision. """
 
 	values = {
-		"words": len([w for w in revision["content"].split() if w not in string.punctuation]),
+		"words": word_counter.count(revision["content"]) if word_counter else utils.count_words(revision["content"]),
 		"images": len(revision["images"]),
 		"links": len(revision["links"]),
 		"urls": len(revision["urls"]),
@@ -101,6 +109,59 @@ def get_values(revision):
 	
 	return values
 
+def extract(language, revisions, stored_output):
+	""" Fold the revisions into the per-revision output from old to new, and write each record right away.
+	One revision is processed at a time, and it is taken out of the parsed history when it is processed.
+	For an update, the stored output is written first and only the newer revisions are extracted. The stored output only has
+	the words, so the other previous values are taken from the fetched revision of the last stored timestamp.
+	Returns the number of extracted revisions and the timestamps of the revisions in reverted spans (of the whole history). """
+
+	previous_values = {
+		"words": 0,
+		"images": 0,
+		"links": 0,
+		"urls": 0,
+		"categories": 0
+	}
+	last_timestamp = next(reversed(stored_output)) if len(stored_output) > 0 else None
+	last_stored_revision = None
+
+	word_counter = utils.WordCounter()
+	reverts = utils.RevertDetector()
+	timestamps = []
+	extracted = 0
+
+	with uio.JSONWriter(args.event, language) as writer:
+		for timestamp, timestamp_output in stored_output.items():
+			# the reverts are marked again after the extraction
+			timestamp_output.pop("reverted", None)
+			writer.write(timestamp, timestamp_output)
+
+		for timestamp, revision in utils_fetch.iter_chronological(revisions):
+			timestamps.append(timestamp)
+			reverts.add(utils.state_fingerprint(revision, REVERT_FIELDS))
+
+			if last_timestamp != None and timestamp <= last_timestamp:
+				last_stored_revision = revision
+				continue
+			if last_stored_revision != None:
+				previous_values = get_values(last_stored_revision)
+				last_stored_revision = None
+
+			values = get_values(revision, word_counter)
+
+			timestamp_output = {}
+			timestamp_output["wikipedian"] = revision["user"]
+			timestamp_output["words"] = values["words"]
+			timestamp_output["edit_type"] = determine_edit_type(values, previous_values)
+			previous_values = values
+
+			writer.write(timestamp, timestamp_output)
+			extracted += 1
+
+	reverted = [timestamp for timestamp, is_reverted in zip(timestamps, reverts.mask()) if is_reverted]
+	return extracted, reverted
+
 def main():
 	""" 
 		Get revision histories and use the size changes of the different elements to determine edit type.
@@ -108,45 +169,37 @@ def main():
 			1) size of content
 			2) wikipedian
 			3) edit type
+			4) reverted, for the revisions in a reverted span
 	"""
 
 	language_titles = get_language_titles()
+	to_fetch = OrderedDict()
 	for language in language_titles.keys():
 		title = language_titles[language]
 
-		if args.check_os == "y":
+		if args.check_os == "y" and args.update != "y":
 			if os.path.isfile("data/%s/%s.json" % (args.event, language)):
 				print("%s has already been processed, moving on..." % language)
 				continue
+		to_fetch[language] = title
+
+	for language, revisions in utils_fetch.fetch_languages(to_fetch, jobs=args.jobs, rate=args.rate):
 		print("\nLanguage:\t", language)
-		print("Title:\t\t", title)
+		print("Title:\t\t", language_titles[language])
 
-		revisions = get_revisions(language, title)
 		if revisions is None: continue
-		timestamps = list(revisions.keys())
-		timestamps.reverse()
-
-		output_dict = OrderedDict()
-		previous_values = {
-			"words": 0,
-			"images": 0,
-			"links": 0,
-			"urls": 0,
-			"categories": 0
-		}
 
-		for n,timestamp in enumerate(timestamps):
-			values = get_values(revisions[timestamp])
+		stored_output = uio.read_stored_output(args.event, language) if args.update == "y" else OrderedDict()
 
-			timestamp_output = {}
-			timestamp_output["wikipedian"] = revisions[timestamp]["user"]
-			timestamp_output["words"] = values["words"]
-			timestamp_output["edit_type"] = determine_edit_type(values, previous_values)
-			previous_values = values
+		with profiler.stage("extract", language) as record:
+			extracted, reverted = extract(language, revisions, stored_output)
+			record["revisions"] = extracted
+		if args.update == "y": print("New revisions:\t", extracted)
 
-			output_dict[timestamp] = timestamp_output
+		with profiler.stage("reverts", language, len(reverted)):
+			mark_reverts(language, reverted)
 
-		uio.save_to_json("%s/" % args.event, language, output_dict)
+	profiler.report("covid19_data_%s" % args.event)
 
 if __name__ == "__main__":
 	main()
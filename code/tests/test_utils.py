@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+"""
+	Checks that the word counts of utils match the counts the extraction scripts made before, i.e.
+	len([w for w in content.split() if w not in string.punctuation]).
+
+	Run from the main repository, e.g.:
+		$ python3 -m pytest code/tests
+"""
+
+import os
+import random
+import string
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+
+def old_count(content):
+	return len([w for w in content.split() if w not in string.punctuation])
+
+def random_text(rng, words):
+	tokens = ["word", "Wort", "ord", "-", "--", ".", "()", "!?", "[[link]]", "a.b", "", "…", "%s" % string.punctuation]
+	separators = [" ", " ", " ", "\n", "\t", "  ", " ", ""]
+	return "".join(rng.choice(tokens) + rng.choice(separators) for _ in range(words))
+
+def random_edit(rng, text):
+	start = rng.randint(0, len(text))
+	end = min(len(text), start + rng.randint(0, 30))
+	return text[:start] + random_text(rng, rng.randint(0, 10)) + text[end:]
+
+class TestCountWords(unittest.TestCase):
+
+	def test_count_words(self):
+		rng = random.Random(0)
+		for _ in range(500):
+			text = random_text(rng, rng.randint(0, 50))
+			self.assertEqual(utils.count_words(text), old_count(text), repr(text))
+
+	def test_word_counter(self):
+		rng = random.Random(1)
+		for _ in range(20):
+			counter = utils.WordCounter()
+			text = ""
+			for _ in range(100):
+				text = random_edit(rng, text) if rng.random() < 0.9 else random_text(rng, rng.randint(0, 50))
+				self.assertEqual(counter.count(text), old_count(text), repr(text))
+
+if __name__ == "__main__":
+	unittest.main()
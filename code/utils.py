@@ -4,26 +4,391 @@
 
 """
 
+import hashlib
+import json
+import numpy as np
+import os
+import re
+import string
+
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from Levenshtein import distance as levenshtein_distance
+from math import ceil
+
+WIKIPEDIAN_TYPES = ["registered", "anonymous", "bot"]
+ANONYMOUS_PATTERN = re.compile(r"([0-9]+[:.]+)+")
+# tokens that are not counted as words: every substring of string.punctuation, e.g. "." or "()"
+PUNCTUATION_TOKENS = frozenset(string.punctuation[i:j] for i in range(len(string.punctuation)) for j in range(i+1, len(string.punctuation)+1))
+
+def _bigrams(string):
+	return Counter(string[i:i+2] for i in range(len(string)-1))
 
 def allow_levenshtein_distance(list1, list2):
-	''' Allow Levenshtein distance between "non-unique" elements, e.g. "Ma'an" and "Maan". '''
-	
+	''' Allow Levenshtein distance between "non-unique" elements, e.g. "Ma'an" and "Maan".
+	Candidates are first filtered on length and shared bigrams, since an edit distance below len(x)/3
+	bounds both. Matches are consumed from multiset counters rather than with repeated list removals. '''
+
 	if len(list1) == 0 or len(list2) == 0: return list1, list2
 
-	for x in set(list1):
-		for y in set(list2):
-
-			distance = levenshtein_distance(x, y)
-			if distance < len(x)/3: 
-				try:
-					list1.remove(x)
-				except ValueError:
-					continue
-				list2.remove(y)
-				
+	remaining1 = Counter(list1)
+	remaining2 = Counter(list2)
+
+	length_buckets = defaultdict(list)
+	for y in remaining2:
+		length_buckets[len(y)].append(y)
+	bigrams = {}
+
+	for x in remaining1:
+		# distance < len(x)/3 for an integer distance
+		max_distance = ceil(len(x)/3) - 1
+		if max_distance < 0: continue
+		x_bigrams = _bigrams(x)
+
+		for length in range(len(x) - max_distance, len(x) + max_distance + 1):
+			for y in length_buckets.get(length, []):
+				if remaining2[y] == 0: continue
+
+				# q-gram lemma: an edit destroys at most two bigrams
+				min_shared = max(len(x), len(y)) - 1 - 2*max_distance
+				if min_shared > 0:
+					if y not in bigrams: bigrams[y] = _bigrams(y)
+					if sum((x_bigrams & bigrams[y]).values()) < min_shared: continue
+
+				if levenshtein_distance(x, y) <= max_distance:
+					remaining1[x] -= 1
+					remaining2[y] -= 1
+					if remaining1[x] == 0: break
+			if remaining1[x] == 0: break
+
+	list1[:] = _remove_matched(list1, remaining1)
+	list2[:] = _remove_matched(list2, remaining2)
 	return list1, list2
 
+def _remove_matched(elements, remaining):
+	''' Drop the first (count - remaining) occurrences of each element, like list.remove would. '''
+
+	to_remove = Counter(elements)
+	to_remove.subtract(remaining)
+
+	kept = []
+	for x in elements:
+		if to_remove[x] > 0:
+			to_remove[x] -= 1
+		else:
+			kept.append(x)
+	return kept
+
+def map_languages(function, languages, jobs=1):
+	''' Apply a function to each language, on a pool of processes when jobs > 1. 
+	Results are yielded in the order of the languages, so the merged output is the same as a serial run. '''
+
+	if jobs <= 1:
+		yield from map(function, languages)
+		return
+
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		yield from executor.map(function, languages)
+
+def count_words(content):
+	''' Count the whitespace-separated tokens that are not punctuation, i.e. not a substring of string.punctuation. '''
+
+	tokens = content.split()
+	return len(tokens) - sum(map(PUNCTUATION_TOKENS.__contains__, tokens))
+
+def _common_prefix_length(a, b):
+	''' Length of the common prefix of two strings, found by binary search on slice comparisons, which run in C. '''
+
+	low, high = 0, min(len(a), len(b))
+	while low < high:
+		middle = (low + high + 1) // 2
+		if a[:middle] == b[:middle]: low = middle
+		else: high = middle - 1
+	return low
+
+def _common_suffix_length(a, b, limit):
+
+	low, high = 0, limit
+	while low < high:
+		middle = (low + high + 1) // 2
+		if a[len(a)-middle:] == b[len(b)-middle:]: low = middle
+		else: high = middle - 1
+	return low
+
+def changed_region(old, new):
+	''' Get the start of the region that differs between two texts, and its end in the old and in the new text.
+	The region is widened to whitespace, so the tokens outside of it are the same in both texts. '''
+
+	start = _common_prefix_length(old, new)
+	suffix = _common_suffix_length(old, new, min(len(old), len(new)) - start)
+	old_end, new_end = len(old) - suffix, len(new) - suffix
+
+	while start > 0 and not old[start-1].isspace():
+		start -= 1
+	while old_end < len(old) and not old[old_end].isspace():
+		old_end += 1
+		new_end += 1
+
+	return start, old_end, new_end
+
+class WordCounter:
+	''' Count words like count_words, but only recount the region that changed since the previous text. '''
+
+	def __init__(self):
+		self.text = ""
+		self.words = 0
+
+	def count(self, text):
+		start, old_end, new_end = changed_region(self.text, text)
+		self.words += count_words(text[start:new_end]) - count_words(self.text[start:old_end])
+		self.text = text
+		return self.words
+
+class _TooManyEdits(Exception):
+	pass
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, max_distance, budget):
+	''' Find the middle snake of a shortest edit script of a[alo:ahi] and b[blo:bhi], searching from both ends (Myers' linear-space variant).
+	Returns the edit distance and the snake as (x, y, u, v), from (x, y) to (u, v) in positions relative to alo and blo.
+	budget is a one-element list with the number of diagonal steps left, shared by all calls for one diff. '''
+
+	n, m = ahi - alo, bhi - blo
+	delta = n - m
+	odd = delta % 2 == 1
+	max_d = (min(n + m, max_distance) + 1) // 2
+	offset = max_d + 1
+	forward = [0] * (2*offset + 1)
+	backward = [0] * (2*offset + 1)
+
+	for d in range(max_d + 1):
+		budget[0] -= 2*d + 1
+		if budget[0] < 0: raise _TooManyEdits()
+
+		for k in range(-d, d+1, 2):
+			if k == -d or (k != d and forward[offset+k-1] < forward[offset+k+1]):
+				x = forward[offset+k+1]
+			else:
+				x = forward[offset+k-1] + 1
+			y = x - k
+			start_x, start_y = x, y
+			while x < n and y < m and a[alo+x] == b[blo+y]:
+				x += 1
+				y += 1
+			budget[0] -= x - start_x
+			forward[offset+k] = x
+			# the backward search of step d-1 reaches this diagonal
+			if odd and -(d-1) <= delta - k <= d-1 and x + backward[offset+delta-k] >= n:
+				return 2*d - 1, (start_x, start_y, x, y)
+
+		# the backward search walks the reversed sequences, its diagonal k is diagonal delta - k of the forward search
+		for k in range(-d, d+1, 2):
+			if k == -d or (k != d and backward[offset+k-1] < backward[offset+k+1]):
+				x = backward[offset+k+1]
+			else:
+				x = backward[offset+k-1] + 1
+			y = x - k
+			start_x, start_y = x, y
+			while x < n and y < m and a[ahi-1-x] == b[bhi-1-y]:
+				x += 1
+				y += 1
+			budget[0] -= x - start_x
+			backward[offset+k] = x
+			if not odd and -d <= delta - k <= d and x + forward[offset+delta-k] >= n:
+				return 2*d, (n - x, m - y, n - start_x, m - start_y)
+
+	raise _TooManyEdits()
+
+def _trim(a, alo, ahi, b, blo, bhi):
+	''' Leave out the common prefix and suffix of a[alo:ahi] and b[blo:bhi]. '''
+
+	while alo < ahi and blo < bhi and a[alo] == b[blo]:
+		alo += 1
+		blo += 1
+	while alo < ahi and blo < bhi and a[ahi-1] == b[bhi-1]:
+		ahi -= 1
+		bhi -= 1
+	return alo, ahi, blo, bhi
+
+def _edit_ranges(a, b, max_distance, budget):
+	''' The ("added", start, end) and ("removed", start, end) ranges of a shortest edit script, by divide and conquer on middle snakes.
+	Only the two diagonal arrays of one middle snake are kept at a time, so memory is linear. '''
+
+	edits = []
+	# the parts left to diff, the leftmost part on top
+	stack = [(0, len(a), 0, len(b))]
+	while stack:
+		alo, ahi, blo, bhi = _trim(a, stack[-1][0], stack[-1][1], b, stack[-1][2], stack[-1][3])
+		stack.pop()
+		if alo == ahi:
+			if blo < bhi: edits.append(("added", blo, bhi))
+			continue
+		if blo == bhi:
+			edits.append(("removed", alo, ahi))
+			continue
+
+		d, (x, y, u, v) = _middle_snake(a, alo, ahi, b, blo, bhi, max_distance, budget)
+		stack.append((alo + u, ahi, blo + v, bhi))
+		stack.append((alo, alo + x, blo, blo + y))
+
+	ranges = []
+	for edit in edits:
+		if ranges and ranges[-1][0] == edit[0] and ranges[-1][2] == edit[1]:
+			ranges[-1] = (edit[0], ranges[-1][1], edit[2])
+		else:
+			ranges.append(edit)
+	return ranges
+
+def _bag_difference(a, b):
+	added, removed = Counter(b) - Counter(a), Counter(a) - Counter(b)
+	return sum(added.values()), sum(removed.values())
+
+def token_diff(old, new, spans=False, max_distance=5000, max_work=200000):
+	''' Get the number of added and removed tokens in a shortest edit script from old to new (Myers' algorithm on int arrays).
+	The search runs from both ends to a middle snake, and with spans=True the script is found by divide and conquer on middle snakes,
+	so memory is linear in both cases. With spans=True, also returns the ("added", start, end) and ("removed", start, end) token ranges,
+	in new and old token positions.
+	Edit scripts longer than max_distance, or that take more than max_work diagonal steps to find, fall back to a bag-of-words
+	difference, which is a lower bound. '''
+
+	ids = {}
+	a = [ids.setdefault(token, len(ids)) for token in old]
+	b = [ids.setdefault(token, len(ids)) for token in new]
+	n, m = len(a), len(b)
+
+	try:
+		# the lengths alone need more edits than max_distance
+		if abs(n - m) > max_distance: raise _TooManyEdits()
+		budget = [max_work]
+		if spans:
+			ranges = _edit_ranges(a, b, max_distance, budget)
+			added = sum(end - start for (kind, start, end) in ranges if kind == "added")
+			return added, sum(end - start for (kind, start, end) in ranges if kind == "removed"), ranges
+
+		alo, ahi, blo, bhi = _trim(a, 0, n, b, 0, m)
+		if alo == ahi or blo == bhi: return bhi - blo, ahi - alo
+		d, _ = _middle_snake(a, alo, ahi, b, blo, bhi, max_distance, budget)
+		removed = (d + (ahi - alo) - (bhi - blo)) // 2
+		return d - removed, removed
+
+	except _TooManyEdits:
+		# too many edits for a token by token comparison, compare the tokens as bags
+		added, removed = _bag_difference(a, b)
+		if not spans: return added, removed
+		return added, removed, [(kind, 0, end) for (kind, end) in [("removed", n), ("added", m)] if end > 0]
+
+def diff_texts(old, new, spans=False):
+	''' Get the number of added and removed (lowercased) words between two texts, diffing only the region that changed.
+	With spans=True, also returns the token ranges of token_diff, in positions of the whole texts. '''
+
+	start, old_end, new_end = changed_region(old, new)
+	result = token_diff(old[start:old_end].lower().split(), new[start:new_end].lower().split(), spans=spans)
+	if not spans: return result
+
+	before = len(old[:start].split())
+	return result[0], result[1], [(kind, before + i, before + j) for (kind, i, j) in result[2]]
+
+def get_wikipedian_type_code(wikipedian):
+	''' Determine whether a wikipedian is registered (0), anonymous (1, an IPv4 or IPv6 address) or a bot (2). '''
+
+	if ANONYMOUS_PATTERN.search(wikipedian) != None: return 1
+	elif wikipedian.lower().endswith("bot"): return 2
+	return 0
+
+class EditorRegistry:
+	''' Interns usernames as integer editor IDs, and classifies each editor once with get_wikipedian_type_code.
+	One registry can be shared by all languages of a run and saved to a JSON file for the next run. '''
+
+	def __init__(self, filename=None):
+		self.filename = filename
+		self.ids = {}
+		self.names = []
+		self.types = []
+
+		if filename != None and os.path.isfile(filename):
+			with open(filename) as infile:
+				stored = json.load(infile)
+			self.names = stored["names"]
+			self.types = stored["types"]
+			self.ids = {name: n for n, name in enumerate(self.names)}
+
+	def register(self, name):
+		if name not in self.ids:
+			self.ids[name] = len(self.names)
+			self.names.append(name)
+			self.types.append(get_wikipedian_type_code(name))
+		return self.ids[name]
+
+	def encode(self, names):
+		''' Get the editor IDs (int32) and the type codes (int8) of a sequence of usernames. '''
+
+		ids = np.array([self.register(name) for name in names], dtype=np.int32)
+		types = np.array(self.types, dtype=np.int8)[ids] if len(ids) > 0 else np.zeros(0, dtype=np.int8)
+		return ids, types
+
+	def save(self):
+		''' Write to a temporary file first, so runs in parallel processes never leave a partly written registry. '''
+
+		os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+		temporary_name = "%s.%s" % (self.filename, os.getpid())
+		with open(temporary_name, 'w') as outfile:
+			json.dump({"names": self.names, "types": self.types}, outfile)
+		os.replace(temporary_name, self.filename)
+
+def _digest(data):
+	return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "big")
+
+def state_fingerprint(revision, fields):
+	''' Hash the state of some fields of a revision, e.g. ["content", "links", "urls"].
+	Lists are hashed as multisets, so a revision that only reorders the elements has the same state.
+	The hash does not depend on the process, so fingerprints can be stored, e.g. in a checkpoint. '''
+
+	parts = []
+	for field in fields:
+		value = revision[field]
+		if isinstance(value, str): parts.append(value)
+		else: parts.append("\x1e".join(sorted(x if isinstance(x, str) else json.dumps(x) for x in value)))
+	return _digest("\x1d".join(parts))
+
+class RevertDetector:
+	''' Finds identity reverts at any distance: a revision with the same state as an earlier revision undoes all revisions in between.
+	The last revision with each state is kept in a dictionary, so a history of n revisions takes n lookups.
+	Add the fingerprints in chronological order. '''
+
+	def __init__(self, fingerprints=()):
+		self.fingerprints = []
+		self.last_seen = {}
+		self.spans = []
+		for fingerprint in fingerprints:
+			self.add(fingerprint)
+
+	def add(self, fingerprint):
+		''' Returns the number of the revision this revision reverts to, or None (also for a revision that changes nothing). '''
+
+		n = len(self.fingerprints)
+		earlier = self.last_seen.get(fingerprint)
+		self.fingerprints.append(fingerprint)
+		self.last_seen[fingerprint] = n
+		if earlier == None or earlier == n-1: return None
+
+		self.spans.append((earlier+1, n))
+		return earlier
+
+	def mask(self):
+		''' A boolean array, True for the revisions in a reverted span: the revisions that were undone and the revision that undid them.
+		Together, the revisions of a span change nothing, so their changes can be left out. '''
+
+		# +1 at the start and -1 after the end of each span, so overlapping spans cost nothing extra
+		boundaries = np.zeros(len(self.fingerprints)+1, dtype=np.int32)
+		for start, end in self.spans:
+			boundaries[start] += 1
+			boundaries[end+1] -= 1
+		return np.cumsum(boundaries[:-1]) > 0
+
+def revert_mask(revisions, fields):
+	''' Get the revert mask of revisions in chronological order, see RevertDetector.mask. '''
+
+	return RevertDetector(state_fingerprint(revision, fields) for revision in revisions).mask()
+
 
 if __name__ == '__main__':
-	allow_levenshtein_distance()
\ No newline at end of file
+	allow_levenshtein_distance()
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""
+	Database utils: the per-revision output of all languages of an event in one SQLite file, for cross-language queries.
+	Ingest the output of covid19_data.py (words, wikipedian, edit_type) or covid19_v2.py (also new_links and deleted_links) with
+
+		$ python3 code/utils_db.py event
+
+	and query it with RevisionDatabase, e.g. RevisionDatabase("covid19").edits_per_day().
+	The event is the folder in data/ with the output files, e.g. "covid19" or "covid19/020720".
+	Languages whose output file has not changed since the last ingestion are skipped.
+"""
+
+import glob
+import os
+import sqlite3
+import utils
+import utils_io as uio
+import utils_time
+
+from collections import OrderedDict
+
+SCHEMA = [
+	'''CREATE TABLE IF NOT EXISTS revisions (
+		language TEXT, timestamp TEXT, epoch INTEGER, editor TEXT, editor_type INTEGER,
+		words INTEGER, change INTEGER, edit_type TEXT, new_links INTEGER, deleted_links INTEGER)''',
+	"CREATE UNIQUE INDEX IF NOT EXISTS revisions_language_timestamp ON revisions (language, timestamp)",
+	"CREATE INDEX IF NOT EXISTS revisions_editor ON revisions (editor)",
+	"CREATE TABLE IF NOT EXISTS link_changes (language TEXT, timestamp TEXT, link TEXT, change INTEGER)",
+	"CREATE INDEX IF NOT EXISTS link_changes_language_timestamp ON link_changes (language, timestamp)",
+	"CREATE TABLE IF NOT EXISTS ingested (language TEXT PRIMARY KEY, filename TEXT, size INTEGER, modified INTEGER)"
+]
+
+class RevisionDatabase:
+	''' The revisions of all languages of an event folder, in data/<event>/revisions.sqlite.
+	A change is the difference in words to the previous revision of the language, the first revision adds all of its words. '''
+
+	def __init__(self, event, filename=None):
+		self.event = event
+		self.filename = filename or "data/%s/revisions.sqlite" % event
+		os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+
+		self.connection = sqlite3.connect(self.filename, timeout=60)
+		for statement in SCHEMA:
+			self.connection.execute(statement)
+
+	def ingest(self, language, revisions):
+		''' Replace the revisions of a language. revisions can be a dictionary or a uio.RevisionStream. '''
+
+		timestamps = list(revisions.keys())
+		epochs = utils_time.parse_timestamps(timestamps).tolist()
+		editor_types = {}
+
+		def rows():
+			previous_words = 0
+			for n, (timestamp, revision) in enumerate(revisions.items()):
+				editor = revision["wikipedian"]
+				if editor not in editor_types: editor_types[editor] = utils.get_wikipedian_type_code(editor)
+				words = revision["words"]
+				yield (language, timestamp, epochs[n], editor, editor_types[editor], words, words - previous_words, revision.get("edit_type"),
+					len(revision.get("new_links", [])), len(revision.get("deleted_links", [])))
+				previous_words = words
+
+		def link_rows():
+			for timestamp, revision in revisions.items():
+				for link in revision.get("new_links", []): yield (language, timestamp, link, 1)
+				for link in revision.get("deleted_links", []): yield (language, timestamp, link, -1)
+
+		with self.connection:
+			self.connection.execute("DELETE FROM revisions WHERE language = ?", (language,))
+			self.connection.execute("DELETE FROM link_changes WHERE language = ?", (language,))
+			self.connection.executemany("INSERT INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+			self.connection.executemany("INSERT INTO link_changes VALUES (?, ?, ?, ?)", link_rows())
+
+	def ingest_event(self):
+		''' Ingest the output files of the event folder, skipping the files that are unchanged since their last ingestion. '''
+
+		ingested = 0
+		for filename in sorted(glob.glob("data/%s/*.json" % self.event)):
+			language = filename.split("/")[-1].split(".")[0]
+			status = os.stat(filename)
+			stored = self.connection.execute("SELECT filename, size, modified FROM ingested WHERE language = ?", (language,)).fetchone()
+			if stored == (filename, status.st_size, status.st_mtime_ns): continue
+
+			print("Ingesting %s" % filename)
+			self.ingest(language, uio.RevisionStream(filename))
+			with self.connection:
+				self.connection.execute("INSERT OR REPLACE INTO ingested VALUES (?, ?, ?, ?)", (language, filename, status.st_size, status.st_mtime_ns))
+			ingested += 1
+		return ingested
+
+	def query(self, sql, parameters=()):
+		return self.connection.execute(sql, parameters).fetchall()
+
+	def languages(self):
+		return [language for (language,) in self.query("SELECT DISTINCT language FROM revisions ORDER BY language")]
+
+	def _where(self, languages):
+		if languages == None: return "", ()
+		return "WHERE language IN (%s)" % ", ".join("?" * len(languages)), tuple(languages)
+
+	def edits_per_day(self, languages=None):
+		''' The number of edits per day of each language, for the days with edits. Returns {language: (days, edits)}. '''
+
+		where, parameters = self._where(languages)
+		edits = OrderedDict()
+		for language, day, count in self.query("SELECT language, substr(timestamp, 1, 10) AS day, COUNT(*) FROM revisions %s GROUP BY language, day ORDER BY language, day" % where, parameters):
+			days, counts = edits.setdefault(language, ([], []))
+			days.append(day)
+			counts.append(count)
+		return edits
+
+	def top_editors(self, language=None, edit_type=None, limit=10):
+		''' The editors with the most edits, of one language or of all languages, optionally of one edit type. '''
+
+		conditions, parameters = [], []
+		if language != None:
+			conditions.append("language = ?")
+			parameters.append(language)
+		if edit_type != None:
+			conditions.append("edit_type = ?")
+			parameters.append(edit_type)
+		where = "WHERE " + " AND ".join(conditions) if conditions else ""
+		return self.query("SELECT editor, COUNT(*) AS edits FROM revisions %s GROUP BY editor ORDER BY edits DESC LIMIT ?" % where, parameters + [limit])
+
+	def change_magnitudes(self, languages=None):
+		''' The number and the size (in words) of the additions and deletions per language and wikipedian type.
+		Returns rows of (language, wikipedian type, additions, words added, deletions, words deleted). '''
+
+		where, parameters = self._where(languages)
+		rows = self.query('''SELECT language, editor_type,
+			SUM(change > 0), SUM(CASE WHEN change > 0 THEN change ELSE 0 END),
+			SUM(change < 0), SUM(CASE WHEN change < 0 THEN -change ELSE 0 END)
+			FROM revisions %s GROUP BY language, editor_type ORDER BY language, editor_type''' % where, parameters)
+		return [(language, utils.WIKIPEDIAN_TYPES[editor_type]) + tuple(values) for (language, editor_type, *values) in rows]
+
+	def creation_times(self):
+		''' The first revision of each language, with its wikipedian type, in order of creation. '''
+
+		rows = self.query('''SELECT language, timestamp, editor_type FROM revisions
+			WHERE (language, timestamp) IN (SELECT language, MIN(timestamp) FROM revisions GROUP BY language) ORDER BY timestamp''')
+		return [(language, timestamp, utils.WIKIPEDIAN_TYPES[editor_type]) for (language, timestamp, editor_type) in rows]
+
+	def close(self):
+		self.connection.close()
+
+if __name__ == "__main__":
+	import argparse
+
+	parser = argparse.ArgumentParser(description='''Ingest the per-revision output of all languages of an event into SQLite.''')
+	parser.add_argument("event", help="e.g. 'covid19' or 'covid19/020720'.")
+	args = parser.parse_args()
+
+	database = RevisionDatabase(args.event)
+	print("Ingested %s languages" % database.ingest_event())
+	database.close()
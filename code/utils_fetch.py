@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""
+	Fetch utils for Wikipedia revision histories, e.g. fetching several language versions at once under one rate limit.
+
+"""
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from WikiRevParser.wikirevparser import wikirevparser
+
+class TokenBucket:
+	''' Rate limit shared by all fetch threads: on average `rate` fetches per second, with bursts of up to `capacity`. '''
+
+	def __init__(self, rate, capacity=1):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+def fetch_revisions(language, title):
+	''' Extract and parse Wikipedia revision history for given language and title. '''
+
+	parser_instance = wikirevparser.ProcessRevisions(language, title)
+
+	page = parser_instance.wikipedia_page()
+	if page == None: return None
+
+	revisions = parser_instance.parse_revisions()
+	if revisions == None: return None
+
+	return revisions
+
+def iter_chronological(revisions):
+	''' Yield the (timestamp, revision) pairs of a parsed revision history from old to new, taking each revision out of the history.
+	The WikiRevParser returns the newest revision first and still parses the whole history at once,
+	but the revisions are released one by one as they are processed. '''
+
+	for timestamp in reversed(list(revisions.keys())):
+		yield timestamp, revisions.pop(timestamp)
+
+def _fetch_with_retries(fetch, bucket, language, title, retries, backoff):
+
+	for attempt in range(retries + 1):
+		bucket.acquire()
+		try:
+			return fetch(language, title)
+		except Exception as err:
+			if attempt == retries:
+				print("Giving up on %s after %s attempts:\t" % (language, attempt + 1), err)
+				return None
+			wait = backoff * 2**attempt
+			print("Fetching %s failed, retrying in %s seconds:\t" % (language, wait), err)
+			time.sleep(wait)
+
+def fetch_languages(language_titles, fetch=fetch_revisions, jobs=4, rate=1/3, retries=3, backoff=5):
+	''' Fetch the revision histories of several languages at once.
+	Every fetch (including retries) takes a token from one bucket, so the languages together stay under `rate` fetches per second.
+	`fetch` is called as fetch(language, title), which lets a local stand-in for the MediaWiki API replace the WikiRevParser.
+	Yields (language, revisions) pairs as the fetches complete, with revisions None if the page could not be fetched.
+	At most `jobs` fetches are in flight, and the next language is only submitted when one completes,
+	so only the histories not yet consumed by the caller are held in memory. '''
+
+	bucket = TokenBucket(rate)
+	pending = iter(language_titles.items())
+	with ThreadPoolExecutor(max_workers=jobs) as executor:
+		futures = {}
+		def submit_next():
+			for language, title in pending:
+				futures[executor.submit(_fetch_with_retries, fetch, bucket, language, title, retries, backoff)] = language
+				return
+
+		for _ in range(jobs): submit_next()
+		while futures:
+			done, _ = wait(futures, return_when=FIRST_COMPLETED)
+			while done:
+				future = done.pop()
+				language = futures.pop(future)
+				submit_next()
+				revisions = future.result()
+				del future
+				yield language, revisions
@@ -3,19 +3,153 @@
 	General IO utils for Wikipedia edit history parsing, e.g. save and read form JSON.
 
 """
+import bisect
 import glob
 import json
+import numpy as np
 import os
+import re
+import sqlite3
+import time
+
+from collections import Counter, OrderedDict
 
 def read_from_json(filename):
 	''' read from json file if the file exists '''
 
 	try:
-		return json.load(open(filename))
+		with open(filename) as infile:
+			return json.load(infile)
 	except FileNotFoundError:
 		print("There is no file called: %s" % filename)
 		return None
 
+# the characters that open or close a string, object or array
+_STRUCTURE = re.compile(r'["{}\[\]]')
+
+def iter_json_items(filename, chunk_size=1 << 16, values=True):
+	''' Incrementally yield the (key, value) pairs of a JSON file with one top-level object. 
+	Only the value being decoded is held in memory, not the whole file.
+	With values=False, the values are skipped without decoding them, and (key, None) pairs are yielded. '''
+
+	decoder = json.JSONDecoder()
+	with open(filename) as infile:
+		buffer = ""
+		position = 0
+
+		def fill(size=chunk_size):
+			nonlocal buffer, position
+			chunk = infile.read(size)
+			buffer = buffer[position:] + chunk
+			position = 0
+			return chunk != ""
+
+		def next_char():
+			nonlocal position
+			while True:
+				while position < len(buffer) and buffer[position].isspace():
+					position += 1
+				if position < len(buffer): return buffer[position]
+				if not fill(): return ""
+
+		def decode():
+			nonlocal position
+			eof = False
+			while True:
+				try:
+					value, end = decoder.raw_decode(buffer, position)
+					# a number at the end of the buffer may continue in the next chunk
+					if eof or buffer[end:].lstrip()[:1] in (",", ":", "}"):
+						position = end
+						return value
+				except json.JSONDecodeError:
+					if eof: raise
+				# grow geometrically so large values are not re-parsed too often
+				eof = not fill(max(chunk_size, len(buffer)))
+
+		def skip():
+			''' Move past a value by matching its brackets and quotes, instead of decoding it. '''
+			nonlocal position
+			if next_char() not in ("{", "["):
+				decode()
+				return
+
+			depth = 0
+			while True:
+				match = _STRUCTURE.search(buffer, position)
+				if match == None:
+					position = len(buffer)
+					if not fill(): raise ValueError("Unexpected end of %s" % filename)
+				elif match.group() == "\"":
+					# find the closing quote with str.find, which is much faster than a regular expression on long strings
+					position = match.start()
+					end = match.end()
+					while True:
+						end = buffer.find("\"", end)
+						if end == -1:
+							end = len(buffer) - position
+							if not fill(max(chunk_size, len(buffer) - position)): raise ValueError("Unexpected end of %s" % filename)
+							continue
+						# a quote after an odd number of backslashes is escaped
+						backslash = end
+						while buffer[backslash-1] == "\\":
+							backslash -= 1
+						end += 1
+						if (end - 1 - backslash) % 2 == 0: break
+					position = end
+				elif match.group() in "{[":
+					depth += 1
+					position = match.end()
+				else:
+					depth -= 1
+					position = match.end()
+					if depth == 0: return
+
+		if next_char() != "{":
+			raise ValueError("%s does not contain a JSON object" % filename)
+		position += 1
+		if next_char() == "}": return
+
+		while True:
+			next_char()
+			key = decode()
+			if next_char() != ":":
+				raise ValueError("Expected ':' after %s in %s" % (key, filename))
+			position += 1
+
+			next_char()
+			if values:
+				yield key, decode()
+			else:
+				skip()
+				yield key, None
+
+			separator = next_char()
+			position += 1
+			if separator == "}": return
+			if separator != ",":
+				raise ValueError("Expected ',' or '}' after %s in %s" % (key, filename))
+
+class RevisionStream:
+	''' Re-iterable view of a revision JSON file that is parsed incrementally on every pass.
+	Items come in file order, which is chronological for files written by save_to_json (sort_keys=True). '''
+
+	def __init__(self, filename):
+		self.filename = filename
+		self._keys = None
+
+	def __iter__(self):
+		for timestamp, _ in iter_json_items(self.filename, values=False):
+			yield timestamp
+
+	def items(self):
+		return iter_json_items(self.filename)
+
+	def keys(self):
+		if self._keys is None:
+			self._keys = [timestamp for timestamp in self]
+		return self._keys
+
 def mkdirectory(directory_name):
 	try:
 		os.mkdir(directory_name)
@@ -33,6 +167,344 @@ def save_to_json(event, language, dictionary):
 	with open(directory_name + file_name, 'w') as outfile:
 		json.dump(dictionary, outfile, sort_keys=True, indent=4)
 
+class JSONWriter:
+	''' Write the per-revision output of a language one record at a time, in the same format as save_to_json.
+	Records are written to a temporary file that replaces data/<event>/<language>.json when the writer is closed,
+	so an interrupted extraction leaves the earlier output as it was. Write the records in chronological order. '''
+
+	def __init__(self, event, language):
+		directory_name = "data/%s/" % event
+		mkdirectory(directory_name)
+		self.file_name = directory_name + "%s.json" % language
+		self.temporary_name = "%s.%s" % (self.file_name, os.getpid())
+		self.outfile = open(self.temporary_name, 'w')
+		self.count = 0
+
+	def write(self, timestamp, record):
+		value = json.dumps(record, sort_keys=True, indent=4).replace("\n", "\n    ")
+		self.outfile.write("%s\n    %s: %s" % ("," if self.count > 0 else "{", json.dumps(timestamp), value))
+		self.count += 1
+
+	def close(self):
+		self.outfile.write("\n}" if self.count > 0 else "{}")
+		self.outfile.close()
+		os.replace(self.temporary_name, self.file_name)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, error_type, error, traceback):
+		if error_type is None:
+			self.close()
+		else:
+			self.outfile.close()
+			os.remove(self.temporary_name)
+
+def read_stored_output(event, language):
+	''' read earlier output of a language in file order, or an empty dictionary if there is none '''
+
+	file_name = "data/%s/%s.json" % (event, language)
+	if not os.path.isfile(file_name): return OrderedDict()
+	with open(file_name) as infile:
+		return json.load(infile, object_pairs_hook=OrderedDict)
+
+class ListFieldReader:
+	''' The state of a list field of covid19_v2.py output at any revision, e.g. the links or citations as of a time.
+	A field is stored as deltas (new_<field> and deleted_<field>), with the full list (<field>_keyframe) every keyframe interval,
+	and sections (and the citations of older output) as the full list when it changes. The state at a revision is rebuilt from the
+	last full list at or before it, so at most one keyframe interval of deltas is replayed. The states of the delta fields are
+	multisets: the elements of the full list in order, followed by the elements added since. '''
+
+	def __init__(self, revisions):
+		self.timestamps = []
+		self.records = []
+		for timestamp, record in revisions.items():
+			self.timestamps.append(timestamp)
+			self.records.append(record)
+		self._full_lists = {}
+
+	def __len__(self):
+		return len(self.timestamps)
+
+	def _full_list(self, field, record):
+		''' The full list of a field in a record, or None if the record only has deltas. '''
+
+		if field + "_keyframe" in record: return record[field + "_keyframe"]
+		return record.get(field)
+
+	def _full_list_revisions(self, field):
+		if field not in self._full_lists:
+			self._full_lists[field] = [n for n, record in enumerate(self.records) if self._full_list(field, record) is not None]
+		return self._full_lists[field]
+
+	def _replay(self, field, state, records):
+		''' Apply the deltas of the records to a state. The state is only counted when there are deltas, since sections are not hashable. '''
+
+		counts = None
+		added = []
+		for record in records:
+			new, deleted = record.get("new_" + field, []), record.get("deleted_" + field, [])
+			if len(new) == 0 and len(deleted) == 0: continue
+			if counts is None: counts = Counter(state)
+			counts.update(new)
+			counts.subtract(deleted)
+			added += new
+
+		if counts is None: return list(state)
+		expanded = []
+		for element in state + added:
+			if counts[element] > 0:
+				counts[element] -= 1
+				expanded.append(element)
+		return expanded
+
+	def state(self, field, n):
+		''' The state of a field after revision n, e.g. reader.state("citations", len(reader) - 1) for the current citations. '''
+
+		if n < 0: return []
+		full_list_revisions = self._full_list_revisions(field)
+		k = bisect.bisect_right(full_list_revisions, n) - 1
+		if k < 0: return self._replay(field, [], self.records[:n+1])
+
+		start = full_list_revisions[k]
+		return self._replay(field, list(self._full_list(field, self.records[start])), self.records[start+1:n+1])
+
+	def state_at(self, field, timestamp):
+		''' The state of a field at a time, i.e. after the last revision at or before the timestamp. '''
+
+		return self.state(field, bisect.bisect_right(self.timestamps, timestamp) - 1)
+
+	def states(self, field):
+		''' Yield the state of a field after each revision, in one pass over the revisions. '''
+
+		state = []
+		for record in self.records:
+			full_list = self._full_list(field, record)
+			state = list(full_list) if full_list is not None else self._replay(field, state, [record])
+			yield state
+
+def save_checkpoint(event, language, name, dictionary):
+	''' save the state of an analysis, so it can resume from the last processed revision '''
+
+	directory_name = "data/%s/checkpoints/" % event
+	mkdirectory(directory_name)
+
+	file_name = "%s_%s.json" % (language, name)
+	with open(directory_name + file_name, 'w') as outfile:
+		json.dump(dictionary, outfile)
+
+def read_checkpoint(event, language, name):
+	''' read the state of an earlier analysis if there is one '''
+
+	file_name = "data/%s/checkpoints/%s_%s.json" % (event, language, name)
+	if not os.path.isfile(file_name): return None
+	return read_from_json(file_name)
+
+def _to_json(value):
+	if isinstance(value, np.ndarray): return value.tolist()
+	if isinstance(value, np.generic): return value.item()
+	raise TypeError("%s is not JSON serializable" % type(value))
+
+def save_result(event, language, dictionary):
+	''' save the analysis result of a language, so the results of all languages can be merged without analysing them again '''
+
+	directory_name = "data/%s/results/" % event
+	mkdirectory(directory_name)
+
+	file_name = "%s.json" % language
+	with open(directory_name + file_name, 'w') as outfile:
+		json.dump(dictionary, outfile, default=_to_json)
+
+def read_results(event):
+	''' read the stored analysis results of all languages, in language order '''
+
+	for file_name in sorted(glob.glob("data/%s/results/*.json" % event)):
+		yield read_from_json(file_name)
+
+SCALAR_FIELDS = {"words": np.int32, "wikipedian": np.int32, "edit_type": np.int8, "reverted": np.bool_}
+LIST_FIELDS = ["new_links", "deleted_links", "links_keyframe", "new_citations", "deleted_citations", "citations_keyframe", "sections", "sections_keyframe", "citations"]
+
+def save_columnar(event, language, dictionary):
+	''' save per-revision output as NumPy columns that can be memory-mapped.
+	Timestamps are int64 epoch seconds, words int32, reverted a boolean, wikipedians and edit types codes into a vocabulary,
+	and list fields are an offsets array into one array of string codes, with a boolean array of the records that have the field. '''
+
+	directory_name = "data/%s/columnar/%s/" % (event, language)
+	os.makedirs(directory_name, exist_ok=True)
+
+	timestamps = list(dictionary.keys())
+	records = list(dictionary.values())
+	np.save(directory_name + "timestamps.npy", np.array([t.rstrip("Z") for t in timestamps], dtype="datetime64[s]").astype(np.int64))
+
+	vocabulary = {}
+	codes = {}
+	def encode(field, value):
+		if value not in codes[field]:
+			codes[field][value] = len(vocabulary[field])
+			vocabulary[field].append(value)
+		return codes[field][value]
+
+	for field, dtype in SCALAR_FIELDS.items():
+		if not any(field in record for record in records): continue
+		if field == "words":
+			column = [record.get(field, -1) for record in records]
+		elif field == "reverted":
+			column = [record.get(field, False) for record in records]
+		else:
+			vocabulary[field], codes[field] = [], {}
+			column = [encode(field, record.get(field)) for record in records]
+		np.save(directory_name + "%s.npy" % field, np.array(column, dtype=dtype))
+
+	# nested elements, e.g. sections per level, are stored as JSON strings
+	vocabulary["strings"], codes["strings"] = [], {}
+	vocabulary["json_fields"] = []
+	for field in LIST_FIELDS:
+		if not any(field in record for record in records): continue
+		as_json = any(not isinstance(value, str) for record in records for value in record.get(field, []))
+		if as_json: vocabulary["json_fields"].append(field)
+
+		offsets = [0]
+		values = []
+		for record in records:
+			for value in record.get(field, []):
+				values.append(encode("strings", json.dumps(value) if as_json else value))
+			offsets.append(len(values))
+		np.save(directory_name + "%s_offsets.npy" % field, np.array(offsets, dtype=np.int64))
+		np.save(directory_name + "%s_values.npy" % field, np.array(values, dtype=np.int32))
+		# an empty keyframe is not the same as no keyframe
+		np.save(directory_name + "%s_present.npy" % field, np.array([field in record for record in records], dtype=np.bool_))
+
+	with open(directory_name + "vocabulary.json", 'w') as outfile:
+		json.dump(vocabulary, outfile)
+
+class ColumnarRevisions:
+	''' Memory-mapped view of the columns written by save_columnar. Columns and vocabularies are opened on first use.
+	items() yields the same (timestamp, record) pairs as the JSON output, for code that expects those. '''
+
+	def __init__(self, directory_name):
+		self.directory_name = directory_name
+		self._columns = {}
+		self._vocabulary = None
+
+	def column(self, field):
+		''' Get a column as a read-only memory-mapped array, or None if it was not saved. '''
+
+		if field not in self._columns:
+			file_name = self.directory_name + "%s.npy" % field
+			self._columns[field] = np.load(file_name, mmap_mode="r") if os.path.isfile(file_name) else None
+		return self._columns[field]
+
+	@property
+	def timestamps(self):
+		return self.column("timestamps")
+
+	@property
+	def vocabulary(self):
+		if self._vocabulary is None:
+			with open(self.directory_name + "vocabulary.json") as infile:
+				self._vocabulary = json.load(infile)
+		return self._vocabulary
+
+	def __len__(self):
+		return len(self.timestamps)
+
+	def keys(self):
+		return [str(t) + "Z" for t in self.timestamps.astype("datetime64[s]")]
+
+	def get_list(self, field, n):
+		''' Get the list field of the n'th revision. '''
+
+		offsets = self.column("%s_offsets" % field)
+		values = [self.vocabulary["strings"][v] for v in self.column("%s_values" % field)[offsets[n]:offsets[n+1]]]
+		if field in self.vocabulary["json_fields"]:
+			return [json.loads(value) for value in values]
+		return values
+
+	def items(self):
+		scalar_fields = [f for f in SCALAR_FIELDS if self.column(f) is not None]
+		list_fields = [f for f in LIST_FIELDS if self.column("%s_offsets" % f) is not None]
+
+		for n, timestamp in enumerate(self.keys()):
+			record = {}
+			for field in scalar_fields:
+				value = int(self.column(field)[n])
+				# like in the JSON output, only reverted revisions have the field
+				if field == "reverted":
+					if value: record[field] = True
+				else: record[field] = value if field == "words" else self.vocabulary[field][value]
+			for field in list_fields:
+				present = self.column("%s_present" % field)
+				if present is not None and not present[n]: continue
+				record[field] = self.get_list(field, n)
+			yield timestamp, record
+
+def read_columnar(event, language):
+	''' read columnar output if it exists '''
+
+	directory_name = "data/%s/columnar/%s/" % (event, language)
+	if not os.path.isfile(directory_name + "timestamps.npy"): return None
+	return ColumnarRevisions(directory_name)
+
+def convert_to_columnar(event):
+	''' migrate the JSON output of an event folder, e.g. "covid19/020720", to columnar output '''
+
+	for language in get_language(event):
+		if read_columnar(event, language) is not None: continue
+		print("Converting %s to columnar output" % language)
+		save_columnar(event, language, read_from_json("data/%s/%s.json" % (event, language)))
+
+class LookupCache:
+	''' Persistent cache in SQLite for the answers of slow lookups, e.g. Wikidata queries, keyed by any JSON-serializable key.
+	A None answer is cached as well (negative caching). Entries expire after ttl seconds, 
+	and the least recently used entries are evicted when there are more than max_entries. '''
+
+	MISSING = object()
+
+	def __init__(self, filename, ttl=30*24*60*60, max_entries=1000000, commit_every=100):
+		os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+		self.ttl = ttl
+		self.max_entries = max_entries
+		self.commit_every = commit_every
+		self.writes = 0
+		# the last use of the keys read since the last commit, written in commit() so reads never take the write lock
+		self.used = {}
+
+		self.connection = sqlite3.connect(filename, timeout=60)
+		self.connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL, used REAL)")
+		self.connection.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+	def get(self, key):
+		''' Get the cached answer for a key, or LookupCache.MISSING if it is not cached or has expired. '''
+
+		key = json.dumps(key)
+		row = self.connection.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+		if row is None or row[1] < time.time() - self.ttl:
+			return self.MISSING
+
+		self.used[key] = time.time()
+		return json.loads(row[0])
+
+	def set(self, key, value):
+		now = time.time()
+		self.connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (json.dumps(key), json.dumps(value), now, now))
+		self.writes += 1
+		if self.writes % self.commit_every == 0:
+			self.commit()
+
+	def commit(self):
+		''' Record when the entries read since the last commit were used, evict expired and least recently used entries
+		and write the cache to disk. '''
+
+		self.connection.executemany("UPDATE cache SET used = ? WHERE key = ? AND used < ?", [(used, key, used) for key, used in self.used.items()])
+		self.used.clear()
+		self.connection.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+		self.connection.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+		self.connection.commit()
+
+	def close(self):
+		self.commit()
+		self.connection.close()
+
 def save_pois_to_tsv(event, language, tsv_output):
 
 	directory_name = "data/%s/tsv/" % event
@@ -58,12 +530,18 @@ def get_language(event):
 
 		yield language
 
-def open_file(event, language):
+def open_file(event, language, stream=False):
 
 	print("\nLanguage:\t", language)
 	print("Event:\t\t", event)
 
 	file_name = "data/%s/%s.json" % (event, language)
+	if stream:
+		if not os.path.isfile(file_name):
+			print("There is no file called: %s" % file_name)
+			return None
+		return RevisionStream(file_name)
+
 	data = read_from_json(file_name)
 	return data
 
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+"""
+	News utils: classify citation urls as local news, foreign news or non-news, with the news sources per country in
+	resources/news_sources/<code>.txt (one domain per line, e.g. "politiken.dk", optionally with a path, e.g. "nrc.nl/next").
+	A citation is local news if its source is on the list of the language version, and foreign news if it is on another list.
+
+"""
+import numpy as np
+import os
+
+NEWS_SOURCES_DIRECTORY = "resources/news_sources/"
+# language versions whose news sources are listed under another code
+LANGUAGE_SOURCES = {"nb": "no", "nn": "no", "lb": "lu", "ga": "ie"}
+NEWS_TYPES = ["local", "foreign", "non-news"]
+# trie key of the sources of a node, labels are never None
+_SOURCES = None
+
+def split_url(url):
+	''' Get the labels of the host of a url from the top level domain down, and the path, e.g.
+	"https://www.dr.dk/nyheder" -> ["dk", "dr", "www"], "nyheder". '''
+
+	url = url.strip().lower()
+	# only a scheme ("https://") or the start of a scheme-relative url ("//www.dr.dk") is stripped, a later "//" is part of the path
+	scheme, separator, rest = url.partition("://")
+	if separator != "" and "/" not in scheme: url = rest
+	elif url.startswith("//"): url = url[2:]
+	host, _, path = url.partition("/")
+	host = host.rsplit("@", 1)[-1].split(":")[0].strip(".")
+	return host.split(".")[::-1], path
+
+class NewsClassifier:
+	''' The news sources of all lists in a trie of reversed domain labels, so a url is looked up with one step per label of its host,
+	however many sources there are. A source matches its subdomains, e.g. "dr.dk" matches "www.dr.dk" but not "addr.dk".
+	The sources of each url are cached, so a url cited in many revisions is only looked up once. '''
+
+	def __init__(self, directory=NEWS_SOURCES_DIRECTORY):
+		self.trie = {}
+		self.codes = []
+		self.cache = {}
+		if directory == None: return
+
+		for file_name in sorted(os.listdir(directory)):
+			if not file_name.endswith(".txt"): continue
+			code = file_name[:-len(".txt")]
+			self.codes.append(code)
+			with open(os.path.join(directory, file_name)) as infile:
+				for line in infile:
+					if line.strip() != "": self.add(line, code)
+
+	def add(self, source, code):
+		''' Add a source, e.g. "https://www.jungewelt.de" or "cphpost.dk/", to the list of a country code. '''
+
+		labels, path = split_url(source)
+		if labels[-1] == "www": labels = labels[:-1]
+
+		node = self.trie
+		for label in labels:
+			node = node.setdefault(label, {})
+		node.setdefault(_SOURCES, {}).setdefault(path.rstrip("/"), set()).add(code)
+		self.cache.clear()
+
+	def sources(self, url):
+		''' Get the codes of the lists with the source of a url, an empty set for non-news. The most specific source counts. '''
+
+		if url in self.cache: return self.cache[url]
+
+		labels, path = split_url(url)
+		codes = frozenset()
+		node = self.trie
+		for label in labels:
+			node = node.get(label)
+			if node == None: break
+			if _SOURCES in node:
+				matches = [prefix for prefix in node[_SOURCES] if prefix == "" or path == prefix or path.startswith(prefix + "/")]
+				if len(matches) > 0: codes = frozenset(node[_SOURCES][max(matches, key=len)])
+
+		self.cache[url] = codes
+		return codes
+
+	def classify(self, url, language):
+		''' Get the news type code of a url for a language version: 0 for local news, 1 for foreign news and 2 for non-news. '''
+
+		codes = self.sources(url)
+		if len(codes) == 0: return 2
+		return 0 if LANGUAGE_SOURCES.get(language, language) in codes else 1
+
+	def shares(self, revisions, language):
+		''' Count the local, foreign and non-news citations of each revision, and of the citations up to each revision,
+		in one pass over (timestamp, citations) pairs in chronological order. The citations of a revision are all its citations.
+		The shares are of all citations, e.g. the cumulative local share is the part of the distinct urls cited so far that are local news. '''
+
+		counts = []
+		cumulative_counts = []
+		cumulative = [0, 0, 0]
+		# the news type of each url cited so far
+		news_types = {}
+		for timestamp, citations in revisions:
+			revision_counts = [0, 0, 0]
+			for url in citations:
+				news_type = news_types.get(url)
+				if news_type == None:
+					news_type = news_types[url] = self.classify(url, language)
+					cumulative[news_type] += 1
+				revision_counts[news_type] += 1
+			counts.append(revision_counts)
+			cumulative_counts.append(list(cumulative))
+
+		counts = np.array(counts, dtype=np.int64).reshape(-1, len(NEWS_TYPES))
+		cumulative_counts = np.array(cumulative_counts, dtype=np.int64).reshape(-1, len(NEWS_TYPES))
+		result = {"counts": counts, "cumulative_counts": cumulative_counts}
+		for name, values in [("shares", counts), ("cumulative_shares", cumulative_counts)]:
+			totals = values.sum(axis=1, keepdims=True)
+			result[name] = np.divide(values, totals, out=np.zeros(values.shape), where=totals > 0)
+		return result
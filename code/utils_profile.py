@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""
+	Profiling utils: wall time, CPU time, revision counts and memory per stage and language.
+	A stage is timed with `with profiler.stage("process_data", language) as record:`, and the record can take the number of revisions.
+	When profiling is off, a stage only yields an empty record, so the stages can stay in the code.
+
+"""
+import csv
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from tabulate import tabulate
+
+PROFILE_MODES = ["n", "y", "memory"]
+
+class Profiler:
+	''' Records stages when enabled. mode "y" records wall time, CPU time and the maximum resident set size of the process,
+	"memory" also traces the peak of the memory allocated by Python during each stage, which slows the stage down. '''
+
+	def __init__(self, mode="n"):
+		if mode not in PROFILE_MODES: raise ValueError("Profile mode should be one of %s, not %s" % (PROFILE_MODES, mode))
+		self.enabled = mode != "n"
+		self.trace_memory = mode == "memory"
+		self.records = []
+		self.open_stages = []
+
+		if self.trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	@contextmanager
+	def stage(self, name, language=None, revisions=None):
+		record = {"stage": name, "language": language, "revisions": revisions}
+		if not self.enabled:
+			yield record
+			return
+
+		if self.trace_memory:
+			self._update_peaks()
+			tracemalloc.reset_peak()
+			record["peak_memory"] = 0
+		self.open_stages.append(record)
+
+		wall, cpu = time.perf_counter(), time.process_time()
+		try:
+			yield record
+		finally:
+			record["wall_time"] = round(time.perf_counter() - wall, 4)
+			record["cpu_time"] = round(time.process_time() - cpu, 4)
+			# kilobytes on Linux, bytes on macOS
+			max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			record["max_rss"] = round(max_rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+			if self.trace_memory:
+				self._update_peaks()
+				record["peak_memory"] = round(record["peak_memory"] / 2**20, 1)
+			record["pid"] = os.getpid()
+
+			self.open_stages.remove(record)
+			self.records.append(record)
+
+	def _update_peaks(self):
+		''' Stages can be nested, so the peak since the last reset is counted in every open stage. '''
+
+		peak = tracemalloc.get_traced_memory()[1]
+		for record in self.open_stages:
+			record["peak_memory"] = max(record["peak_memory"], peak)
+
+	def collect(self):
+		''' Take the records, e.g. in a worker process that returns them with its results. '''
+
+		records, self.records = self.records, []
+		return records
+
+	def extend(self, records):
+		self.records.extend(records)
+
+	def summary(self):
+		''' Totals per stage, sorted by wall time. '''
+
+		totals = defaultdict(lambda: {"calls": 0, "wall_time": 0, "cpu_time": 0, "revisions": 0, "peak_memory": None})
+		for record in self.records:
+			total = totals[record["stage"]]
+			total["calls"] += 1
+			total["wall_time"] += record["wall_time"]
+			total["cpu_time"] += record["cpu_time"]
+			total["revisions"] += record["revisions"] or 0
+			if record.get("peak_memory") != None:
+				total["peak_memory"] = max(total["peak_memory"] or 0, record["peak_memory"])
+
+		return sorted(totals.items(), key=lambda item: item[1]["wall_time"], reverse=True)
+
+	def report(self, name):
+		''' Save the records to data/profiles/<name>_<time>.json and .csv, and print the summary table. '''
+
+		if not self.enabled: return
+
+		directory_name = "data/profiles/"
+		os.makedirs(directory_name, exist_ok=True)
+		file_name = directory_name + "%s_%s" % (name, datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+		with open(file_name + ".json", 'w') as outfile:
+			json.dump(self.records, outfile, indent=4)
+
+		fields = ["stage", "language", "revisions", "wall_time", "cpu_time", "max_rss", "peak_memory", "pid"]
+		with open(file_name + ".csv", 'w', newline="") as outfile:
+			writer = csv.DictWriter(outfile, fieldnames=fields, extrasaction="ignore")
+			writer.writeheader()
+			writer.writerows(self.records)
+
+		table = []
+		for stage, total in self.summary():
+			revisions_per_second = round(total["revisions"] / total["wall_time"]) if total["revisions"] and total["wall_time"] else None
+			table.append([stage, total["calls"], round(total["wall_time"], 2), round(total["cpu_time"], 2), total["revisions"] or None, revisions_per_second, total["peak_memory"]])
+
+		print("\n********** Profile **********")
+		print(tabulate(table, headers=["Stage", "Calls", "Wall time (s)", "CPU time (s)", "Revisions", "Revisions/s", "Peak memory (MiB)"]))
+		print("Saved the profile to %s.json and %s.csv" % (file_name, file_name))
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+"""
+	Time utils for revision timestamps, e.g. "2020-03-11T16:02:41Z".
+	Revisions are counted in hours, days or weeks (starting on Mondays) in UTC, and the bins of several languages can be aligned
+	into one languages x bins matrix with resample, e.g. to compare the edit rates of all language versions of an event.
+
+"""
+import numpy as np
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+BUCKET_SECONDS = {"hour": 60*60, "day": 24*60*60, "week": 7*24*60*60}
+# the epoch is a Thursday, weeks start on Mondays
+BUCKET_OFFSETS = {"hour": 0, "day": 0, "week": 3*24*60*60}
+
+def parse_timestamps(timestamps):
+	''' Parse timestamps to seconds since the epoch (int64), with NumPy instead of one strptime per timestamp. '''
+
+	# NumPy warns about the "Z" suffix, the timestamps are UTC anyway
+	return np.array([timestamp.rstrip("Z") for timestamp in timestamps], dtype="datetime64[s]").astype(np.int64)
+
+def to_epoch(value):
+	''' Seconds since the epoch of a timestamp, e.g. "2020-03-11T16:02:41Z" or "2020-03-11", or of a datetime. '''
+
+	if isinstance(value, str): value = value.rstrip("Z")
+	return int(np.datetime64(value, "s").astype(np.int64))
+
+def bin_starts(first_bin, bins, unit="day"):
+	''' The start of each of a range of bins as a datetime. '''
+
+	starts = np.arange(first_bin, first_bin + bins) * BUCKET_SECONDS[unit] - BUCKET_OFFSETS[unit]
+	return starts.astype("datetime64[s]").astype(object).tolist()
+
+def shared_bins(epochs_per_language, unit="day", start=None, end=None):
+	''' The first bin and the number of bins of a range shared by several languages.
+	start and end default to the first and the last revision of all languages. Returns (0, 0) when there are no revisions. '''
+
+	non_empty = [epochs for epochs in epochs_per_language if len(epochs) > 0]
+	if start == None and len(non_empty) > 0: start = min(int(epochs[0]) for epochs in non_empty)
+	elif start != None: start = to_epoch(start)
+	if end == None and len(non_empty) > 0: end = max(int(epochs[-1]) for epochs in non_empty)
+	elif end != None: end = to_epoch(end)
+	if start == None or end == None or end < start: return 0, 0
+
+	first_bin = (start + BUCKET_OFFSETS[unit]) // BUCKET_SECONDS[unit]
+	last_bin = (end + BUCKET_OFFSETS[unit]) // BUCKET_SECONDS[unit]
+	return first_bin, last_bin - first_bin + 1
+
+def resample(epochs_per_language, unit="day", start=None, end=None, weights=None):
+	''' Count the revisions (or sum the weights of the revisions) of several languages per hour, day or week, over one shared range.
+	epochs_per_language are sorted arrays of seconds since the epoch, e.g. TimestampIndex.epochs, and weights one array per language.
+	All languages are binned in one pass over the concatenated revisions, revisions outside the range are left out.
+	Returns the start of each bin as a datetime and a languages x bins matrix, with 0 for the bins without edits. '''
+
+	first_bin, bins = shared_bins(epochs_per_language, unit, start, end)
+	rows = len(epochs_per_language)
+	dtype = np.int64 if weights is None else np.float64
+	if bins == 0: return [], np.zeros((rows, 0), dtype=dtype)
+
+	lengths = [len(epochs) for epochs in epochs_per_language]
+	epochs = np.concatenate([np.asarray(epochs, dtype=np.int64) for epochs in epochs_per_language] + [np.zeros(0, dtype=np.int64)])
+	columns = (epochs + BUCKET_OFFSETS[unit]) // BUCKET_SECONDS[unit] - first_bin
+	languages = np.repeat(np.arange(rows), lengths)
+
+	in_range = (columns >= 0) & (columns < bins)
+	cells = languages[in_range] * bins + columns[in_range]
+	if weights is not None:
+		weights = np.concatenate([np.asarray(w, dtype=np.float64) for w in weights] + [np.zeros(0)])[in_range]
+	matrix = np.bincount(cells, weights=weights, minlength=rows * bins).reshape(rows, bins).astype(dtype)
+	return bin_starts(first_bin, bins, unit), matrix
+
+def resample_last(epochs_per_language, values_per_language, unit="day", start=None, end=None):
+	''' The value of the last revision at or before the end of each bin, e.g. the number of links of each language at the end of each day.
+	Uses the same shared range as resample. Bins before the first revision of a language are NaN. '''
+
+	first_bin, bins = shared_bins(epochs_per_language, unit, start, end)
+	matrix = np.full((len(epochs_per_language), bins), np.nan)
+	if bins == 0: return [], matrix
+
+	ends = (np.arange(first_bin + 1, first_bin + bins + 1)) * BUCKET_SECONDS[unit] - BUCKET_OFFSETS[unit]
+	for row, (epochs, values) in enumerate(zip(epochs_per_language, values_per_language)):
+		if len(epochs) == 0: continue
+		last = np.searchsorted(epochs, ends, side="left") - 1
+		values = np.asarray(values, dtype=np.float64)
+		matrix[row] = np.where(last >= 0, values[np.maximum(last, 0)], np.nan)
+	return bin_starts(first_bin, bins, unit), matrix
+
+class TimestampIndex:
+	''' The revision times of a language, parsed once. The timestamps are sorted like the keys of the revision histories. '''
+
+	def __init__(self, timestamps):
+		self.timestamps = sorted(timestamps)
+		self.epochs = parse_timestamps(self.timestamps)
+		self._datetimes = None
+
+	def __len__(self):
+		return len(self.timestamps)
+
+	def datetimes(self):
+		''' The revision times as datetime objects, e.g. for plotting. '''
+
+		if self._datetimes == None:
+			self._datetimes = self.epochs.astype("datetime64[s]").astype(object).tolist()
+		return self._datetimes
+
+	def bins(self, unit="day"):
+		''' The number of the hour, day or week of each revision, counted from the epoch. '''
+
+		return (self.epochs + BUCKET_OFFSETS[unit]) // BUCKET_SECONDS[unit]
+
+	def bucket(self, unit="day", weights=None):
+		''' Count the revisions (or sum the weights of the revisions) per hour, day or week, from the first to the last revision.
+		Buckets without edits are included with 0. Returns the start of each bucket as a datetime and the counts. '''
+
+		starts, matrix = resample([self.epochs], unit, weights=None if weights is None else [weights])
+		return starts, matrix[0]
@@ -1,12 +1,32 @@
 #!/usr/bin/python3
 """
 	Visualization utils for revision analysis.
+
+	A plot is a job of plain data, (kind, filename, args), drawn by the draw function of its kind.
+	The plot_* functions render their jobs right away, or hand them to a PlotRenderer, which renders on a
+	pool of processes while the analysis continues. A job is skipped if the PNG on disk was drawn from the same data.
 """
+import hashlib
+import json
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+import numpy as np
+import os
 import plotly.graph_objects as go
-import utils_io as uio
+import struct
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+# bump to redraw all plots after a change in a draw function
+PLOT_VERSION = 1
+HASH_KEY = "Newswork data hash"
 
-def plot_wikipedian_edittypes(wikipedian_edittypes, timestamps, topic, language):
+# one figure per kind of plot, cleared and reused by the process that renders it
+_figures = {}
+
+def draw_wikipedian_edittypes(fig, ax, wikipedian_edittypes, timestamps):
 
 	wikipedian_edit_style = {
 		"anon_content": ["indianred", "dashed"],
@@ -17,7 +37,6 @@ def plot_wikipedian_edittypes(wikipedian_edittypes, timestamps, topic, language)
 		"bot_editorial": ["darkolivegreen", "dotted"]
 	}
 
-	fig, ax = plt.subplots()
 	for w_e in wikipedian_edittypes:
 		ax.plot(timestamps, wikipedian_edittypes[w_e], color=wikipedian_edit_style[w_e][0], linestyle=wikipedian_edit_style[w_e][1], label=" ".join(w_e.split("_")))
 	ax.tick_params(labelbottom=False)
@@ -30,39 +49,171 @@ def plot_wikipedian_edittypes(wikipedian_edittypes, timestamps, topic, language)
 	ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.05),
 	          fancybox=True, shadow=True, ncol=3)
 
-	directory_name = "visualizations/%s/wikipedian_edittypes/" % topic
-	uio.mkdirectory(directory_name)
-	file_name = "%s.png" % language
-	plt.savefig(directory_name + file_name)
-	plt.close()
-
-def plot_content_magnitude(content_sizes, timestamps, topic, language):
-	fig, ax = plt.subplots()
+def draw_content_magnitude(fig, ax, content_sizes, timestamps):
 	ax.plot(timestamps, content_sizes, color="orange", label="content magnitude")
 	ax.tick_params(labelbottom=False)
 	ax.legend()
 
-	directory_name = "visualizations/%s/content_magnitude/" % topic
-	uio.mkdirectory(directory_name)
-	file_name = "%s.png" % language
-	plt.savefig(directory_name + file_name)
-	plt.close()
+def draw_additions_deletions(fig, ax, registered, anonymous, bots, timestamps):
+	ax.plot(timestamps, registered, label="registered")
+	ax.plot(timestamps, anonymous, label="anonymous")
+	ax.plot(timestamps, bots, label="bots")
+	ax.legend()
+
+def draw_changes(fig, ax, dates, added, removed, totals, element_type):
+	ax.plot(dates, added, color="darkolivegreen", label="added")
+	ax.plot(dates, removed, color="indianred", label="removed")
+	ax.plot(dates, totals, color="steelblue", label="total")
+	ax.set_title(element_type)
+	ax.legend()
+
+def draw_article_development(fig, ax, dates, data, elements, changes):
+	for element, values in zip(elements, data):
+		if changes:
+			added, removed = values
+			ax.plot(dates, added, label="%s added" % element)
+			ax.plot(dates, removed, label="%s removed" % element)
+		else:
+			ax.plot(dates, np.ravel(values), label=element)
+	fig.autofmt_xdate()
+	ax.legend()
+
+def draw_element_across_languages(fig, ax, dates, values, element, languages):
+	for language_dates, language_values, language in zip(dates, values, languages):
+		ax.plot(language_dates, language_values, label=language)
+	ax.set_title(element)
+	fig.autofmt_xdate()
+	ax.legend(fontsize="x-small", ncol=2)
+
+DRAW = {
+	"wikipedian_edittypes": draw_wikipedian_edittypes,
+	"content_magnitude": draw_content_magnitude,
+	"additions_deletions": draw_additions_deletions,
+	"changes": draw_changes,
+	"article_development": draw_article_development,
+	"element_across_languages": draw_element_across_languages
+}
+
+def _jsonable(value):
+	if isinstance(value, np.ndarray): return value.tolist()
+	if isinstance(value, np.generic): return value.item()
+	if isinstance(value, (date, datetime)): return value.isoformat()
+	# e.g. ranges and dict views
+	return list(value)
+
+def job_hash(job):
+	''' Hash the kind and data of a plot job, the filename is left out. '''
+
+	kind, filename, args = job
+	data = json.dumps([PLOT_VERSION, kind, args], default=_jsonable, sort_keys=True)
+	return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+def stored_hash(filename):
+	''' Get the data hash from the text chunks of a PNG, or None. '''
+
+	try:
+		with open(filename, "rb") as infile:
+			png = infile.read()
+	except OSError:
+		return None
 
-def plot_additions_deletions_per_wikipediantype(data, timestamps, topic, language):
+	position = 8
+	while position + 8 <= len(png):
+		length, chunk_type = struct.unpack(">I4s", png[position:position+8])
+		if chunk_type == b"tEXt":
+			key, _, value = png[position+8:position+8+length].partition(b"\0")
+			if key.decode("latin-1") == HASH_KEY: return value.decode("latin-1")
+		position += length + 12
+	return None
+
+def render(job):
+	''' Draw and save one plot job. Returns False if the PNG on disk already holds the same data. '''
+
+	kind, filename, args = job
+	digest = job_hash(job)
+	if stored_hash(filename) == digest: return False
+
+	if kind in _figures:
+		fig = _figures[kind]
+		fig.clear()
+	else:
+		fig = _figures[kind] = plt.figure()
+	ax = fig.add_subplot()
+	DRAW[kind](fig, ax, *args)
+
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	fig.savefig(filename, metadata={HASH_KEY: digest})
+	return True
+
+class PlotRenderer:
+	''' Render plot jobs on a pool of processes. With jobs=0 the jobs are only collected,
+	e.g. in a worker process that returns them to the main process with its results. '''
+
+	def __init__(self, jobs=1):
+		self.jobs = jobs
+		self.collected = []
+		self.futures = []
+		self.executor = None
+
+	def submit(self, job):
+		if self.jobs <= 0:
+			self.collected.append(job)
+			return
+		if self.executor == None:
+			self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+		self.futures.append((job, self.executor.submit(render, job)))
+
+	def submit_all(self, jobs):
+		for job in jobs:
+			self.submit(job)
+
+	def close(self):
+		''' Wait for the submitted jobs, and print how many plots were rendered, skipped and failed.
+		A plot that fails is reported and the other plots are still rendered. '''
+
+		if self.executor == None: return
+		rendered, failed = 0, 0
+		for job, future in self.futures:
+			try:
+				rendered += future.result()
+			except Exception as err:
+				failed += 1
+				print("Couldn't plot %s because:\t" % job[1], err)
+		print("Rendered %s plots, %s were up to date, %s failed." % (rendered, len(self.futures) - rendered - failed, failed))
+		self.executor.shutdown()
+		self.executor = None
+		self.futures = []
+
+def _plot(job, renderer):
+	if renderer == None: render(job)
+	else: renderer.submit(job)
+
+def plot_wikipedian_edittypes(wikipedian_edittypes, timestamps, topic, language, renderer=None):
+	filename = "visualizations/%s/wikipedian_edittypes/%s.png" % (topic, language)
+	_plot(("wikipedian_edittypes", filename, (wikipedian_edittypes, timestamps)), renderer)
+
+def plot_content_magnitude(content_sizes, timestamps, topic, language, renderer=None):
+	filename = "visualizations/%s/content_magnitude/%s.png" % (topic, language)
+	_plot(("content_magnitude", filename, (content_sizes, timestamps)), renderer)
+
+def plot_additions_deletions_per_wikipediantype(data, timestamps, topic, language, renderer=None):
 
 	for (change,endings) in [("additions", "add"), ("deletions", "del")]:
+		filename = f"visualizations/{topic}/additions_deletions/{language}_{change}.png"
+		args = (data[f"registered_{endings}"], data[f"anonymous_{endings}"], data[f"bot_{endings}"], timestamps)
+		_plot(("additions_deletions", filename, args), renderer)
 
-		fig, ax = plt.subplots()
-		ax.plot(timestamps, data[f"registered_{endings}"], label="registered")
-		ax.plot(timestamps, data[f"anonymous_{endings}"], label="anonymous")
-		ax.plot(timestamps, data[f"bot_{endings}"], label="bots")
-		ax.legend()
+def plot_changes(dates, added, removed, totals, topic, language, element_type, renderer=None):
+	filename = "visualizations/%s/%s/%s.png" % (topic, element_type, language)
+	_plot(("changes", filename, (dates, added, removed, totals, element_type)), renderer)
 
-		directory_name = f"visualizations/{topic}/additions_deletions/"
-		uio.mkdirectory(directory_name)
-		file_name = f"{language}_{change}.png"
-		plt.savefig(directory_name + file_name)
-		plt.close()
+def plot_article_development(dates, data, elements, topic, language, name, renderer=None):
+	filename = "visualizations/%s/%s/%s.png" % (topic, name, language)
+	_plot(("article_development", filename, (dates, list(data), elements, name == "article_changes")), renderer)
+
+def plot_element_across_languages(dates, values, element, languages, topic, renderer=None):
+	filename = "visualizations/%s/%s.png" % (topic, element.replace(" ", "_"))
+	_plot(("element_across_languages", filename, (dates, values, element, languages)), renderer)
 
 def plot_creation_time(creation_dates, LVs, colors, continents):
 
@@ -74,7 +225,7 @@ def plot_creation_time(creation_dates, LVs, colors, continents):
 	    marker=dict(color=colors, size=8),
 	    text=continents
 	))
-	
+
 	fig.update_layout(
 		title="Date of page creation",
 	    xaxis_title="Date",
@@ -86,4 +237,4 @@ def plot_creation_time(creation_dates, LVs, colors, continents):
 
 if __name__ == "__main__":
 	plot_over_time()
-	plot_content_development()
\ No newline at end of file
+	plot_content_development()